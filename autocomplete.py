@@ -0,0 +1,189 @@
+from array import array
+from django.conf import settings
+from django.core.cache import cache
+from . import models, pending
+import threading
+import unicodedata
+
+# Shared counter bumped whenever a vocabulary changes; each process
+# rebuilds its indexes when it sees a new value
+VERSION_KEY = "shfa:autocomplete:version"
+
+# Vocabularies indexed in process: model, fields searched per language and ordering
+VOCABULARIES = {
+    "keywords": (models.KeywordTag, {"sv": ["text", "category"],
+                                     "en": ["english_translation", "category_translation"]}, ["text", "category"]),
+    "people": (models.People, {"sv": ["name"], "en": ["english_translation"]}, ["name"]),
+    "dating": (models.DatingTag, {"sv": ["text"], "en": ["english_translation"]}, ["text"]),
+    "type": (models.ImageTypeTag, {"sv": ["text"], "en": ["english_translation"]}, ["text"]),
+    "institution": (models.Institution, {"sv": ["name"], "en": ["name"]}, ["name"]),
+    "rock carving": (models.RockCarvingObject, {"sv": ["name"], "en": ["name"]}, ["name"]),
+}
+
+
+def enabled() -> bool:
+    """Whether autocomplete is answered from the in-process indexes."""
+    return getattr(settings, "SHFA_IN_PROCESS_AUTOCOMPLETE", False)
+
+
+def fold(value) -> str:
+    """Lowercased value without diacritics, e.g. "Hällristning" -> "hallristning"."""
+    decomposed = unicodedata.normalize("NFKD", str(value).strip().lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def bump_version():
+    """Make every process rebuild its autocomplete indexes on next use."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def schedule_bump():
+    """Bump the version once the current transaction commits, once per transaction."""
+    pending.schedule("autocomplete-version", lambda _: bump_version())
+
+
+def suffix_order(forms):
+    """Form indexes and offsets of the suffixes of forms, sorted by suffix.
+
+    Built by prefix doubling on integer ranks rather than by sorting the
+    suffix strings, so no suffix is copied: each round orders the suffixes
+    by twice as many characters, until the longest form is covered.
+    """
+    form_ids, offsets, ends = array("I"), array("I"), array("I")
+    end = 0
+    for f, form in enumerate(forms):
+        form_ids.extend([f] * len(form))
+        offsets.extend(range(len(form)))
+        end += len(form)
+        ends.extend([end] * len(form))
+
+    text = "".join(forms)
+    rank = [ord(c) for c in text]
+    order = list(range(len(text)))
+    longest = max(map(len, forms), default=0)
+    k = 1
+    while True:
+        # Suffixes that end before k characters sort first
+        def key(p):
+            return rank[p], rank[p + k] if p + k < ends[p] else -1
+
+        order.sort(key=key)
+        if 2 * k >= longest:
+            break
+        new_rank = [0] * len(order)
+        for previous, p in zip(order, order[1:]):
+            new_rank[p] = new_rank[previous] + (key(p) != key(previous))
+        rank = new_rank
+        k *= 2
+
+    return array("I", (form_ids[p] for p in order)), array("I", (offsets[p] for p in order))
+
+
+class SuffixIndex:
+    """Suffix array of the folded forms of a list of entries.
+
+    Each suffix is kept as a (form, offset) pair of integers, sorted by the
+    suffix it denotes, so the index takes a few bytes per character rather
+    than a string per suffix, also while it is built. A substring lookup is a binary search for the
+    first suffix starting with the folded query, followed by a scan over
+    the matching suffixes. Matches are returned in the order of the entries.
+    """
+
+    def __init__(self, entries):
+        self.payloads = []
+        self.forms = []
+        self.owners = []
+        for forms, payload in entries:
+            for form in {fold(form) for form in forms if form}:
+                self.forms.append(form)
+                self.owners.append(len(self.payloads))
+            self.payloads.append(payload)
+
+        self.form_ids, self.offsets = suffix_order(self.forms)
+
+    def _prefix(self, k, length):
+        """The first length characters of the k-th suffix."""
+        offset = self.offsets[k]
+        return self.forms[self.form_ids[k]][offset:offset + length]
+
+    def search(self, q):
+        q = fold(q)
+        if not q:
+            return []
+
+        lo, hi = 0, len(self.offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._prefix(mid, len(q)) < q:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        found = set()
+        for k in range(lo, len(self.offsets)):
+            if self._prefix(k, len(q)) != q:
+                break
+            found.add(self.owners[self.form_ids[k]])
+        return [self.payloads[owner] for owner in sorted(found)]
+
+
+class AutocompleteEngine:
+    """Vocabulary and suggestion indexes, built at first use."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._vocabularies = None
+        self._suggestions = None
+
+    def _build(self):
+        vocabularies = {}
+        for name, (model, languages, ordering) in VOCABULARIES.items():
+            fields = sorted({field for fields in languages.values() for field in fields})
+            rows = list(model.objects.order_by(*ordering, 'id').values('id', *fields))
+            vocabularies[name] = {
+                language: SuffixIndex(([row[field] for field in fields], row['id']) for row in rows)
+                for language, fields in languages.items()
+            }
+
+        rows = models.SearchSuggestion.objects.order_by('term', 'source').values_list(
+            'term', 'source', 'image_count')
+        suggestions = SuffixIndex(([term], (term, source, image_count)) for term, source, image_count in rows)
+
+        self._vocabularies, self._suggestions = vocabularies, suggestions
+
+    def _current(self):
+        version = cache.get(VERSION_KEY, 0)
+        if self._vocabularies is None or version != self._version:
+            with self._lock:
+                if self._vocabularies is None or version != self._version:
+                    self._build()
+                    self._version = version
+
+    def search(self, vocabulary, q, language="sv"):
+        """IDs of the vocabulary entries matching q, in the vocabulary ordering."""
+        self._current()
+        indexes = self._vocabularies[vocabulary]
+        return indexes.get(language, indexes["sv"]).search(q)
+
+    def suggest(self, q, limit):
+        """Suggestions containing q, ranked like suggestions.suggest."""
+        self._current()
+        folded = fold(q)
+
+        def rank(suggestion):
+            term, source, image_count = suggestion
+            term_folded = fold(term)
+            match = 2 if term_folded == folded else 1 if term_folded.startswith(folded) else 0
+            return -match, -image_count, term, source
+
+        return [
+            {"term": term, "source": source}
+            for term, source, _ in sorted(self._suggestions.search(q), key=rank)[:limit]
+        ]
+
+
+engine = AutocompleteEngine()
@@ -0,0 +1,198 @@
+from collections import Counter, defaultdict
+from itertools import chain
+from . import models
+
+# Country of a site is taken from the province, or from the top of the
+# administrative unit hierarchy for sites outside of Sweden
+SUPERREGION_NAME = "municipality__superregion__superregion__superregion__superregion__name"
+
+
+def count_facets(image_queryset):
+    """Count all facets of the images in a queryset in a single pass.
+
+    Reads the precomputed ImageFacets rows of the matching images, so the
+    many-to-many tables are only read for images saved since their row was
+    last built. Returns one Counter per facet, keyed by the ID of the facet
+    value (or the year); people are counted per combination of IDs, so
+    that creators can be counted once per image by name.
+    """
+    counts = {
+        "people": Counter(),
+        "keywords": Counter(),
+        "institutions": Counter(),
+        "types": Counter(),
+        "years": Counter(),
+        "sites": Counter(),
+    }
+
+    rows = (
+        models.ImageFacets.objects
+        .filter(image_id__in=image_queryset.order_by().values('id'))
+        .values_list('site_id', 'type_id', 'institution_id', 'year', 'people_ids', 'keyword_ids')
+    )
+
+    for site_id, type_id, institution_id, year, people_ids, keyword_ids in chain(
+            rows.iterator(chunk_size=5000), _relation_rows(image_queryset)):
+        counts["sites"][site_id] += 1
+        counts["types"][type_id] += 1
+        counts["institutions"][institution_id] += 1
+        counts["years"][year] += 1
+        if people_ids:
+            counts["people"][tuple(people_ids)] += 1
+        counts["keywords"].update(keyword_ids)
+
+    # Images without a site still count towards the geographic summary
+    for name, counter in counts.items():
+        if name != "sites":
+            counter.pop(None, None)
+
+    return counts
+
+
+def _relation_rows(image_queryset):
+    """Facet rows, read from the image and its relations, of the images
+    that have no ImageFacets row yet."""
+    images = list(
+        image_queryset.order_by().filter(facets__isnull=True)
+        .values_list('id', 'site_id', 'type_id', 'institution_id', 'year')
+    )
+    if not images:
+        return
+
+    image_ids = [row[0] for row in images]
+    people = defaultdict(list)
+    for image_id, people_id in models.Image.people.through.objects.filter(
+            image_id__in=image_ids).values_list('image_id', 'people_id'):
+        people[image_id].append(people_id)
+    keywords = defaultdict(list)
+    for image_id, keyword_id in models.Image.keywords.through.objects.filter(
+            image_id__in=image_ids).values_list('image_id', 'keywordtag_id'):
+        keywords[image_id].append(keyword_id)
+
+    for pk, *facts in images:
+        yield (*facts, sorted(people[pk]), sorted(keywords[pk]))
+
+
+def _by_count(entries):
+    return sorted(entries, key=lambda entry: -entry["count"])
+
+
+def summarize(image_queryset):
+    """Summarize a filtered image queryset by creator, institution, type,
+    motif, year, site and geography.
+
+    Facet values are resolved to labels with one small query per facet,
+    restricted to the values that actually occur.
+    """
+    counts = count_facets(image_queryset)
+
+    summary = {}
+
+    # Creators are grouped by name, counting each image once per name
+    people_ids = {pk for combination in counts["people"] for pk in combination}
+    names = dict(models.People.objects.filter(id__in=people_ids).values_list('id', 'name'))
+    creators = Counter()
+    for combination, count in counts["people"].items():
+        for name in {names.get(pk) for pk in combination}:
+            if name:
+                creators[name] += count
+    summary["creators"] = _by_count(
+        {"creator": name, "count": count}
+        for name, count in creators.items()
+    )
+
+    institutions = models.Institution.objects.filter(id__in=counts["institutions"]).values_list('id', 'name')
+    summary["institutions"] = _by_count(
+        {"institution": name, "count": counts["institutions"][pk]}
+        for pk, name in institutions if name
+    )
+
+    summary["year"] = [
+        {"year": year, "count": count}
+        for year, count in sorted(counts["years"].items()) if year
+    ]
+
+    types = models.ImageTypeTag.objects.filter(id__in=counts["types"]).values_list('id', 'text', 'english_translation')
+    summary["types"] = _by_count(
+        {"type": text, "translation": translation, "count": counts["types"][pk]}
+        for pk, text, translation in types if text
+    )
+
+    keywords = models.KeywordTag.objects.filter(id__in=counts["keywords"]).values_list(
+        'id', 'text', 'english_translation', 'category_translation', 'figurative')
+    summary["motifs"] = _by_count(
+        {"motif": text, "translation": translation, "count": counts["keywords"][pk], "figurative": figurative}
+        for pk, text, translation, category_translation, figurative in keywords
+        if "figure" in (category_translation or "").lower() and text
+    )
+
+    summary.update(summarize_sites(counts["sites"]))
+    return summary
+
+
+def summarize_sites(site_counts):
+    """Site and geographic summaries from image counts per site ID."""
+    sites = models.Site.objects.filter(id__in=site_counts).values_list(
+        'id', 'raa_id', 'lamning_id', 'askeladden_id', 'lokalitet_id', 'placename', 'ksamsok_id',
+        'municipality__name', 'parish__name', 'province__name', 'province__country__name', SUPERREGION_NAME,
+    )
+
+    site_totals = Counter()
+    geographic_totals = Counter()
+    if site_counts.get(None):
+        geographic_totals[(None, None, None, None, None)] += site_counts[None]
+    for pk, *ids, municipality, parish, province, country, superregion in sites:
+        count = site_counts[pk]
+        if any(ids):
+            site_totals[tuple(ids)] += count
+        geographic_totals[(municipality, parish, province, country, superregion)] += count
+
+    summary = {}
+    summary["site"] = _by_count(
+        {
+            "raa_id": raa_id,
+            "lamning_id": lamning_id,
+            "askeladden_id": askeladden_id,
+            "lokalitet_id": lokalitet_id,
+            "placename": placename,
+            "ksamsok_id": ksamsok_id,
+            "count": count,
+        }
+        for (raa_id, lamning_id, askeladden_id, lokalitet_id, placename, ksamsok_id), count in site_totals.items()
+    )
+
+    geographic = _by_count(
+        {
+            "municipality": municipality,
+            "parish": parish,
+            "province": province,
+            "country": country,
+            "superregion": superregion,
+            "count": count,
+        }
+        for (municipality, parish, province, country, superregion), count in geographic_totals.items()
+    )
+
+    summary["province"] = [
+        {"province": entry["province"], "country": entry["country"], "count": entry["count"]}
+        for entry in geographic if entry["province"]
+    ]
+    summary["municipality"] = [
+        {"municipality": entry["municipality"], "country": entry["country"] or entry["superregion"], "count": entry["count"]}
+        for entry in geographic if entry["municipality"]
+    ]
+    summary["parish"] = [
+        {"parish": entry["parish"], "province": entry["province"], "country": entry["country"], "count": entry["count"]}
+        for entry in geographic if entry["parish"]
+    ]
+    summary["geographic"] = [
+        {
+            "municipality": entry["municipality"],
+            "parish": entry["parish"],
+            "province": entry["province"],
+            "country": entry["country"] or entry["superregion"],
+            "count": entry["count"],
+        }
+        for entry in geographic
+    ]
+    return summary
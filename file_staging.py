@@ -0,0 +1,155 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Default number of files staged concurrently
+WORKERS = 8
+
+# Manifest of staged files, kept in the target directory
+MANIFEST_NAME = ".staging-manifest.json"
+
+# ioctl request that clones a file on copy-on-write filesystems (Linux FICLONE)
+FICLONE = 0x40049409
+
+
+def checksum(path, block_size=1 << 20) -> str:
+    """SHA-256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(path) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    os.replace(tmp, path)
+
+
+def _reflink(source, target):
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def place_file(source, target, link=True) -> str:
+    """Put a copy of source at target.
+
+    On the same filesystem the file is reflinked or, failing that,
+    hardlinked; otherwise (or with link=False) it is copied. Copies are
+    written to a temporary file first, so an interrupted run never leaves a
+    truncated target behind.
+
+    Returns:
+        str: The method used, "reflink", "hardlink" or "copy"
+    """
+    tmp = f"{target}.part"
+    if link and os.stat(source).st_dev == os.stat(os.path.dirname(target)).st_dev:
+        if fcntl is not None:
+            try:
+                _reflink(source, tmp)
+                shutil.copystat(source, tmp)
+                os.replace(tmp, target)
+                return "reflink"
+            except OSError:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        try:
+            if os.path.lexists(target):
+                os.remove(target)
+            os.link(source, target)
+            return "hardlink"
+        except OSError:
+            pass
+
+    shutil.copy2(source, tmp)
+    os.replace(tmp, target)
+    return "copy"
+
+
+def stage_files(files, target_root, workers=WORKERS, verify=False, link=True):
+    """Stage source files into a target directory on a thread pool.
+
+    Files whose target already has the size and modification time of the
+    source, or that the manifest records as staged from an identical
+    source, are skipped, so reruns only transfer changed files. With
+    verify, copies are checked against the SHA-256 of the source and the
+    checksum is kept in the manifest.
+
+    Args:
+        files (list): (source path, target name relative to target_root) pairs
+        target_root (str): Directory to stage the files into
+
+    Returns:
+        Counter: Number of files per outcome (skipped, copy, hardlink,
+        reflink, missing, failed)
+    """
+    os.makedirs(target_root, exist_ok=True)
+    manifest_path = os.path.join(target_root, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    def stage(item):
+        source, name = item
+        target = os.path.join(target_root, name)
+        try:
+            stat = os.stat(source)
+        except FileNotFoundError:
+            return name, "missing", None
+
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        staged = manifest.get(name, {})
+        try:
+            target_stat = os.stat(target)
+        except FileNotFoundError:
+            target_stat = None
+
+        if target_stat is not None and target_stat.st_size == stat.st_size and (
+            target_stat.st_mtime_ns == stat.st_mtime_ns
+            or (staged.get("size"), staged.get("mtime_ns")) == (stat.st_size, stat.st_mtime_ns)
+        ):
+            return name, "skipped", {**staged, **entry}
+
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            method = place_file(source, target, link=link)
+            if verify:
+                entry["sha256"] = checksum(source)
+                if method == "copy" and checksum(target) != entry["sha256"]:
+                    os.remove(target)
+                    raise OSError(f"Checksum mismatch for {target}")
+        except OSError as e:
+            print(f"Could not stage {source}: {e}")
+            return name, "failed", None
+
+        return name, method, entry
+
+    files = list(files)
+    counts = Counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for name, outcome, entry in tqdm(executor.map(stage, files), total=len(files)):
+            counts[outcome] += 1
+            if entry:
+                manifest[name] = entry
+            else:
+                manifest.pop(name, None)
+
+    save_manifest(manifest_path, manifest)
+    return counts
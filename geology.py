@@ -0,0 +1,62 @@
+from django.contrib.gis.db.models import PolygonField
+from django.db import transaction
+from django.db.models import F, Func, Value
+from . import models, pending
+
+# Simplification tolerance in degrees of each resolution level; level 0 is
+# the full geometry
+TOLERANCES = {
+    1: 0.00001,
+    2: 0.0001,
+    3: 0.001,
+}
+
+# Width of a viewport in pixels, used to pick a resolution from a bbox
+VIEWPORT_PIXELS = 1024
+
+# Long text fields of the geology layer; all are returned by default, and a
+# ?fields= list leaves out the ones it does not name
+HEAVY_FIELDS = {"description", "desc_translation"}
+
+
+def resolution_for_bbox(bbox) -> int:
+    """Coarsest resolution whose tolerance stays below a pixel of the viewport."""
+    pixel = min(bbox[2] - bbox[0], bbox[3] - bbox[1]) / VIEWPORT_PIXELS
+    fitting = [resolution for resolution, tolerance in TOLERANCES.items() if tolerance <= pixel]
+    return max(fitting, default=0)
+
+
+def refresh_simplified_geology(ids=None) -> int:
+    """Rebuild the simplified polygons of the given geologies, or of all.
+
+    Polygons are simplified by PostGIS with ST_SimplifyPreserveTopology, so
+    they stay valid at every resolution. Returns the number of rows.
+    """
+    geologies = models.Geology.objects.filter(coordinates__isnull=False)
+    if ids is not None:
+        geologies = geologies.filter(id__in=ids)
+
+    objs = []
+    for resolution, tolerance in TOLERANCES.items():
+        rows = geologies.annotate(simplified=Func(
+            F('coordinates'), Value(tolerance), function='ST_SimplifyPreserveTopology', output_field=PolygonField(),
+        )).values_list('id', 'simplified')
+        objs.extend(
+            models.SimplifiedGeology(geology_id=pk, resolution=resolution, tolerance=tolerance, coordinates=polygon)
+            for pk, polygon in rows
+        )
+
+    with transaction.atomic():
+        stale = models.SimplifiedGeology.objects.all()
+        if ids is not None:
+            stale = stale.filter(geology_id__in=ids)
+        stale.delete()
+        models.SimplifiedGeology.objects.bulk_create(objs, batch_size=500)
+
+    return len(objs)
+
+
+def schedule_refresh(ids):
+    """Rebuild the simplified polygons of geologies once the current
+    transaction commits, with one rebuild per transaction."""
+    pending.schedule("simplified-geology", refresh_simplified_geology, ids)
@@ -0,0 +1,147 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from requests.adapters import HTTPAdapter, Retry
+from .manifest.config import IIIF_CONFIG
+from . import models
+import logging
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the backfill worker
+BATCH_SIZE = 200
+CONCURRENCY = 8
+TIMEOUT = 10
+MAX_ATTEMPTS = 5
+
+# A claimed task is handed to another worker if not finished within this time
+LEASE = timedelta(minutes=5)
+
+
+def needs_dimensions(image) -> bool:
+    """Whether the width or height of an image is missing and can be fetched."""
+    return (image.width is None or image.height is None) and bool(image.iiif_file)
+
+
+def enqueue(image_ids):
+    """Add images to the dimension backfill queue, ignoring queued ones."""
+    models.ImageDimensionTask.objects.bulk_create(
+        [models.ImageDimensionTask(image_id=image_id) for image_id in image_ids],
+        ignore_conflicts=True,
+    )
+
+
+def enqueue_missing() -> int:
+    """Queue every image that still lacks width or height. Returns the number of candidates."""
+    image_ids = list(
+        models.Image.objects
+        .filter(Q(width__isnull=True) | Q(height__isnull=True))
+        .exclude(iiif_file="")
+        .exclude(iiif_file__isnull=True)
+        .values_list('id', flat=True)
+    )
+    for start in range(0, len(image_ids), BATCH_SIZE):
+        enqueue(image_ids[start:start + BATCH_SIZE])
+    return len(image_ids)
+
+
+def info_url(image, base_url=None) -> str:
+    """URL of the IIIF info.json of an image."""
+    base_url = base_url or IIIF_CONFIG['IIIF_URL']
+    iiif_file_url = getattr(image.iiif_file, 'url', None)
+    if not iiif_file_url:
+        return None
+    if not iiif_file_url.startswith("http"):
+        iiif_file_url = base_url.rstrip("/") + "/" + iiif_file_url.lstrip("/")
+    return f"{iiif_file_url}/info.json"
+
+
+def make_session(concurrency=CONCURRENCY) -> requests.Session:
+    """HTTP session with a connection pool sized for the worker threads."""
+    session = requests.Session()
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_dimensions(session, url, timeout=TIMEOUT):
+    """Read width and height from an info.json. Raises on failure."""
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+    info = response.json()
+    width, height = info.get("width"), info.get("height")
+    if not width or not height:
+        raise ValueError(f"No width or height in {url}")
+    return int(width), int(height)
+
+
+def claim_tasks(batch_size=BATCH_SIZE):
+    """Lease a batch of due tasks, skipping those claimed by other workers."""
+    now = timezone.now()
+    with transaction.atomic():
+        tasks = list(
+            models.ImageDimensionTask.objects
+            .select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now, attempts__lt=MAX_ATTEMPTS)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        models.ImageDimensionTask.objects.filter(
+            image_id__in=[task.image_id for task in tasks]
+        ).update(next_attempt_at=now + LEASE)
+    return tasks
+
+
+def process_batch(session, batch_size=BATCH_SIZE, concurrency=CONCURRENCY, base_url=None, timeout=TIMEOUT):
+    """Fetch the dimensions of one batch of queued images.
+
+    Info documents are fetched concurrently, found dimensions are written
+    with a single bulk_update (which fires no post_save signal) and failed
+    tasks are retried later with exponential backoff.
+
+    Returns:
+        tuple: Number of claimed tasks, updated images and failed images
+    """
+    tasks = claim_tasks(batch_size)
+    if not tasks:
+        return 0, 0, 0
+
+    images = models.Image.objects.in_bulk([task.image_id for task in tasks])
+
+    def fetch(task):
+        image = images.get(task.image_id)
+        if image is None or not needs_dimensions(image):
+            return task, image, None, None
+        try:
+            return task, image, fetch_dimensions(session, info_url(image, base_url), timeout), None
+        except Exception as e:
+            return task, image, None, e
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, tasks))
+
+    updated, done, failed = [], [], []
+    now = timezone.now()
+    for task, image, dimensions, error in results:
+        if error is not None:
+            task.attempts += 1
+            task.last_error = str(error)[:2000]
+            task.next_attempt_at = now + timedelta(minutes=2 ** task.attempts)
+            failed.append(task)
+            logger.warning(f"Could not fetch IIIF info for image {task.image_id}: {error}")
+            continue
+        if dimensions:
+            image.width, image.height = dimensions
+            updated.append(image)
+        done.append(task.image_id)
+
+    with transaction.atomic():
+        models.Image.objects.bulk_update(updated, ["width", "height"])
+        models.ImageDimensionTask.objects.filter(image_id__in=done).delete()
+        models.ImageDimensionTask.objects.bulk_update(failed, ["attempts", "last_error", "next_attempt_at"])
+
+    return len(tasks), len(updated), len(failed)
@@ -1,13 +1,17 @@
 #%%
 from .models import *
+from . import search_cache, file_staging, regions, suggestions, tag_index, tiles, site_stats
 from django.contrib.gis.geos import Point
 from apps.geography.models import *
 from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.conf import settings
 #%%
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 import os
-import shutil
 from tqdm import tqdm
 import pandas as pd
 import re
@@ -16,9 +20,22 @@ import requests
 from requests.adapters import HTTPAdapter, Retry
 from typing import Tuple
 from PIL import Image as pillow
+import time
 
 pillow.MAX_IMAGE_PIXELS = None
 
+# Number of image rows inserted per transaction by load_images
+CHUNK_SIZE = 1000
+
+# Directory of the image files, relative to the MEDIA_ROOT
+IMAGE_DIRECTORY = "shfa/original"
+
+# Number of concurrent K-samsök requests when resolving sites
+FETCH_WORKERS = 8
+
+# Columns of an image row that identify its site
+SITE_COLUMNS = ('Lämningsnummer', 'Raanr', 'KMSUri')
+
 #%%
 def get_or_none(classmodel: models.Model, **kwargs):
     try:
@@ -30,21 +47,50 @@ def get_or_none(classmodel: models.Model, **kwargs):
     except classmodel.MultipleObjectsReturned:
         return None
 
-def fetch_and_parse_fornsok_xml(url: str):
+def make_fornsok_session(workers: int = 1) -> requests.Session:
 
-    # Fetch data
     s = requests.Session()
 
     retries = Retry(total=5,
                     backoff_factor=0.1,
                     status_forcelist=[ 500, 502, 503, 504 ])
 
-    s.mount('http://', HTTPAdapter(max_retries=retries))
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retries)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+
+    return s
+
+
+def fetch_fornsok_xml(url: str, session: requests.Session, cache_dir: str = None) -> bytes:
+    """Fetch a K-samsök record, through an on-disk cache if a directory is given."""
 
-    response = s.get(url)
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".xml")
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as file:
+                return file.read()
+
+    response = session.get(url, timeout=30)
+    response.raise_for_status()
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + ".part", "wb") as file:
+            file.write(response.content)
+        os.replace(cache_path + ".part", cache_path)
+
+    return response.content
+
+
+def fetch_and_parse_fornsok_xml(url: str, session: requests.Session = None, cache_dir: str = None):
+
+    # Fetch data
+    content = fetch_fornsok_xml(url, session or make_fornsok_session(), cache_dir)
 
     # Parse the XML
-    return parse_fornsök_xml(response.content)
+    return parse_fornsök_xml(content)
 
 
 def parse_fornsök_xml(content: str):
@@ -131,8 +177,33 @@ def parse_year(year_note):
         return int(matches[0])
 
 #%%
+def assign_regions(sites) -> int:
+    """Set the municipality, parish and province of sites from their
+    coordinates, as a single spatial join UPDATE.
+
+    Each region is the one whose (GiST-indexed) geometry contains the site.
+    For the municipality, a unit whose bounding box contains the site is
+    used if there is none.
+    """
+    def containing(model, lookup="contains"):
+        regions = model.objects.order_by('id').values('id')
+        return Subquery(regions.filter(**{f"geometry__{lookup}": OuterRef('coordinates')})[:1])
+
+    return sites.filter(coordinates__isnull=False).update(
+        municipality=Coalesce(containing(LocalAdministrativeUnit), containing(LocalAdministrativeUnit, "bbcontains")),
+        parish=containing(Parish),
+        province=containing(Province),
+    )
+
+
 @transaction.atomic
 def load_sites(sites_path):
+    """Load the sites of a JSON file and place them in their regions.
+
+    Returns:
+        tuple: The loaded sites, and the mistakes: UUIDs of records without
+        coordinates and (uuid, x, y) of sites outside of every municipality
+    """
 
     Site.objects.all().delete()
 
@@ -152,13 +223,6 @@ def load_sites(sites_path):
         if longitude and latitude:
 
             point = Point(x=float(longitude), y=float(latitude))
-            try:
-                lau = LocalAdministrativeUnit.objects.get(geometry__contains=point) 
-            except:
-                try: 
-                    lau = LocalAdministrativeUnit.objects.get(geometry__bbcontains=point) 
-                except:
-                    mistakes.append((s['uuid'], point.x, point.y))
 
             raa_id = s.get('raär_id', None)
             lamning_id = s.get('lämning_id', None)
@@ -168,7 +232,6 @@ def load_sites(sites_path):
                 raa_id=raa_id,
                 lamning_id=lamning_id,
                 coordinates=point,
-                municipality=lau
                 )
 
             if s['uuid'] not in uuids:
@@ -180,6 +243,16 @@ def load_sites(sites_path):
 
     Site.objects.bulk_create(sites)
 
+    # One spatial join instead of point-in-polygon queries per site
+    assign_regions(Site.objects.all())
+
+    unmatched = Site.objects.filter(coordinates__isnull=False, municipality__isnull=True)
+    for uuid, point in unmatched.values_list('ksamsok_id', 'coordinates'):
+        mistakes.append((uuid, point.x, point.y))
+    print(f"{len(sites)} sites loaded, {unmatched.count()} outside of every municipality")
+    site_stats.refresh_site_stats()
+    tiles.bump_version()
+
     return sites, mistakes
         
 #%%
@@ -255,13 +328,29 @@ def load_name_tables(images_path):
     RockCarvingObject.objects.bulk_create([RockCarvingObject(name=r) for r in objs])
 
 
-def get_all_keywords_of_image(image_keyword_df, image_id):
+def lookup(classmodel: models.Model, field: str) -> dict:
+    """Map the values of a field to primary keys in a single query.
+
+    Like get_or_none, values shared by several rows resolve to nothing.
+    """
+    ids = {}
+    duplicates = set()
+    for value, pk in classmodel.objects.values_list(field, 'id'):
+        if value is None:
+            continue
+        if value in ids:
+            duplicates.add(value)
+        ids[value] = pk
+
+    for value in duplicates:
+        del ids[value]
 
-    keyword_ids = image_keyword_df[image_keyword_df["BildId"] == image_id]["NyckelordId"].unique()
+    return ids
 
-    keywords = [KeywordTag.objects.get(legacy_id=keyword_id) for keyword_id in keyword_ids]
 
-    return keywords
+def group_keywords(image_keyword_df) -> dict:
+    """Map each BildId to the legacy IDs of its keywords, with a single groupby."""
+    return image_keyword_df.groupby("BildId")["NyckelordId"].unique().to_dict()
 
 #%%
 @transaction.atomic
@@ -274,91 +363,135 @@ def delete_all():
         model.objects.all().delete()
 
 #%%
-@transaction.atomic
-def get_site(row) -> Site:
-    """Tries to get a rock carving site based on either Lämningsnummer
-    or K-Samsök.
+def site_key(row) -> tuple:
+    """The site reference of an image row, with missing values as None."""
+    return tuple(None if pd.isna(row.get(column)) else row.get(column) for column in SITE_COLUMNS)
+
 
-    Args:
-        row (dict): A json-like dict from the miljödata database
+def resolve_sites(df, cache_dir: str = None, workers: int = FETCH_WORKERS) -> dict:
+    """Resolve each distinct site reference of the image rows once.
 
-    Raises:
-        Exception: If the Site does not exist
+    Existing sites are matched against lamning_id, raa_id and ksamsok_id
+    indexes built with one query each. Unmatched references are read from
+    the KMSPresentation XML or, if it has no point, fetched from K-samsök:
+    each URI once, concurrently, through one pooled session and the on-disk
+    cache in cache_dir. New sites are created in bulk and placed in their
+    municipality, parish and province through assign_regions.
 
     Returns:
-        Site: An SHFA rock carving site
+        dict: Site ID (or None) for each site_key
     """
+    by_lamning = lookup(Site, 'lamning_id')
+    by_raa = lookup(Site, 'raa_id')
+    by_ksamsok = lookup(Site, 'ksamsok_id')
 
-    lamning_id = row.get('Lämningsnummer', None)
-    kms_uri = row.get('KMSUri', None)
-    raa_id = row.get('Raanr', None)
-    site = None
+    sites = {}
+    records = {}  # (ksamsok_id, lamning_id, point) of sites to create
+    fetch = {}    # URL of the K-samsök record to fetch
 
-    # First check if we can get the site by lämning ID
-    if (not site) and (lamning_id):
+    for row in tqdm(df.drop_duplicates(subset=[c for c in SITE_COLUMNS if c in df.columns]).to_dict('records')):
 
-        site = get_or_none(Site, **{"lamning_id": lamning_id})
+        key = site_key(row)
+        lamning_id, raa_id, kms_uri = key
 
-    # Check if there is a RAÄ ID being used
-    if (not site) and (raa_id):
+        site_id = by_lamning.get(lamning_id) or by_raa.get(raa_id)
+        if site_id or not kms_uri:
+            sites[key] = site_id
+            continue
 
-        site = get_or_none(Site, **{"raa_id": raa_id})
+        try:
+            parsed = parse_lamning(kms_uri)
+            site_id = by_ksamsok.get(parsed[1]) if parsed else None
 
-    # If not, check if we have the K-Samsök ID in the database
-    if (not site) and (kms_uri):
+            if not site_id:
+                # Observe, old K-Samsök does not save RAÄ ID
+                _, ksamsok_id, record_lamning_id, point = parse_fornsök_xml(row["KMSPresentation"])
+                site_id = by_ksamsok.get(ksamsok_id) or by_raa.get(record_lamning_id)
 
-        parsed = parse_lamning(kms_uri)
+                if not site_id and point:
+                    records[key] = (ksamsok_id, record_lamning_id, point)
+                elif not site_id:
+                    fetch[key] = parse_fmi_or_lamning(kms_uri)[0]
 
-        if parsed:
+        except Exception as e:
+            print(f"Could not resolve site {key}: {e}")
+
+        sites[key] = site_id
 
-            site = get_or_none(Site, **{"ksamsok_id": parsed[1]})
+    # Fetch each K-samsök record once
+    urls = sorted(set(fetch.values()))
+    fetched = {}
+    if urls:
+        session = make_fornsok_session(workers)
 
-        # If it does not exist there either, fetch it from the API
-        if not site or not parsed:    
-  
+        def fetch_record(url):
             try:
-                # Observe, old K-Samsök does not save RAÄ ID
-                raa_id, ksamsok_id, lamning_id, point = parse_fornsök_xml(row["KMSPresentation"])                
+                return url, fetch_and_parse_fornsok_xml(url, session, cache_dir)
+            except Exception as e:
+                print(f"Could not fetch {url}: {e}")
+                return url, None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fetched = dict(tqdm(executor.map(fetch_record, urls), total=len(urls)))
+
+    for key, url in fetch.items():
+        if fetched.get(url):
+            _, ksamsok_id, lamning_id, point = fetched[url]
+            sites[key] = by_ksamsok.get(ksamsok_id)
+            if not sites[key]:
+                records[key] = (ksamsok_id, lamning_id, point)
+
+    # Create the new sites, one per K-samsök ID
+    new_sites = {}
+    for ksamsok_id, lamning_id, point in records.values():
+        if ksamsok_id not in new_sites:
+            new_sites[ksamsok_id] = Site(
+                ksamsok_id=ksamsok_id,
+                lamning_id=lamning_id,
+                coordinates=Point(x=point[0], y=point[1]) if point else None,
+            )
 
-                site = get_or_none(Site, **{"ksamsok_id": ksamsok_id})
+    with transaction.atomic():
+        Site.objects.bulk_create(new_sites.values())
+        assign_regions(Site.objects.filter(id__in=[site.id for site in new_sites.values()]))
 
-                if not site:
-                    site = get_or_none(Site, **{"raa_id": lamning_id})
+    for key, (ksamsok_id, lamning_id, point) in records.items():
+        sites[key] = new_sites[ksamsok_id].id
 
-            except etree.XMLSyntaxError as e:
-                print(f"Could not parse XML. No site found. ID: {ksamsok_id}")
-                return None
+    print(f"{len(sites)} site references, {len(urls)} records fetched, {len(new_sites)} sites created")
+    return sites
 
-            if not site:
-                
-                if point:
-                    point = Point(x=point[0], y=point[1])
-                else:
-
-                    try:
-                        parsed = parse_fmi_or_lamning(kms_uri)
-                        raa_id, ksamsok_id, lamning_id, point = fetch_and_parse_fornsok_xml(parsed[0])   
-                    
-                    except etree.XMLSyntaxError as e:
-                        print(f"Could not parse fetched XML. No site found. ID: {ksamsok_id}, URI: {parsed[0]}")
-                        return None
-                    
-                lau = get_or_none(LocalAdministrativeUnit, **{"geometry__contains": point})
-                if not lau:
-                    lau = get_or_none(LocalAdministrativeUnit, **{"geometry__bbcontains": point})
-                
 
-                site, _ = Site.objects.get_or_create(
-                                                ksamsok_id=ksamsok_id,
-                                                lamning_id=lamning_id,
-                                                coordinates=point,
-                                                municipality=lau)
-    
-    return site
+def stage_image_files(path, images_root, **kwargs):
+    """Stage the files of the Swedish image records in the MEDIA_ROOT.
+
+    Runs before, and outside of, the database import. Keyword arguments are
+    passed on to file_staging.stage_files.
+    """
+    df = pd.read_json(path, orient="records")
+    df = df[df['LandId'] == 1]
 
+    files = [(os.path.join(images_root, f"{image_id}.jpg"), f"{image_id}.jpg") for image_id in df['BildId']]
+    counts = file_staging.stage_files(files, os.path.join(settings.MEDIA_ROOT, IMAGE_DIRECTORY), **kwargs)
+    print(", ".join(f"{count} {outcome}" for outcome, count in sorted(counts.items())))
 
-@transaction.atomic
-def load_images(path, keywords_path, images_root):
+    return counts
+
+
+def load_images(path, keywords_path, chunk_size=CHUNK_SIZE, cache_dir=None):
+    """Load the images of the miljödata export in bulk.
+
+    Foreign keys are resolved through lookup dictionaries built once, the
+    sites of all rows are resolved before inserting, and each chunk is
+    loaded in one transaction. Images already loaded (by legacy ID) are
+    skipped, so an interrupted import can be resumed.
+
+    Images are saved one by one, as Image.save() builds the pyramid TIFF
+    (iiif_file) of each image; their keyword and dating rows are inserted
+    with bulk_create. The signals of the saves are collected per chunk, so
+    the search documents of a chunk are refreshed, and its images without
+    dimensions queued for the backfill, once when it commits.
+    """
 
     # Read from JSON files
     df = pd.read_json(path, orient="records")
@@ -367,52 +500,77 @@ def load_images(path, keywords_path, images_root):
     # Select only the Swedish records
     df = df[df['LandId'] == 1]
 
-    for idx, row in tqdm(df.iterrows(), total=len(df)):
-
-        # Fetch the site
-        try:
-            site = get_site(row)
-        except Exception as e:
-            print(e)
-            print(row)
-            site = None
-            
-
-        # Handle properties
-        collection          = get_or_none(Collection, **{"legacy_id": row['SamlingId']})
-        institution         = get_or_none(Institution, **{"legacy_id": row["InstitutionId"]})
-        author              = get_or_none(Author, **{"name": row["Fotograf"]})
-        image_type_tag      = get_or_none(ImageTypeTag, **{"legacy_id": row['TypId']})
-        rock_carving_object = get_or_none(RockCarvingObject, **{"name": row["Objektnamn"]})
-        dating_tag          = get_or_none(DatingTag, **{"legacy_id": row["DateringsId"]})
-
-        date_note           = row['Årtal']
-        year                = parse_year(date_note)
-
-        # Files must be put in the MEDIA_ROOT
-        source_path = os.path.join(images_root, f"{row['BildId']}.jpg")
-        filepath = os.path.join("shfa/original", f"{row['BildId']}.jpg")
-        target_path = os.path.join(settings.MEDIA_ROOT, filepath)
-        shutil.copyfile(source_path, target_path)
-        
-
-        image = Image(
-            legacy_id = row['BildId'],
-            file = filepath,
-            site = site,
-            collection = collection,
-            institution = institution,
-            author = author,
-            type = image_type_tag,
-            year = year,
-            date_note = date_note,
-            rock_carving_object=rock_carving_object
-        )
-
-        image.save()
-
-        # Now get all the keywords
-        keywords = get_all_keywords_of_image(image_keyword_df, row['BildId'])
-        image.keywords.add(*keywords)
-        if dating_tag:
-            image.dating_tags.add(dating_tag)
+    # Skip the images of chunks committed by an earlier run
+    loaded = set(Image.objects.filter(legacy_id__isnull=False).values_list('legacy_id', flat=True))
+    df = df[~df['BildId'].isin(loaded)]
+    print(f"{len(loaded)} images already loaded, {len(df)} to load")
+
+    # Lookup dictionaries for the foreign keys
+    collections          = lookup(Collection, 'legacy_id')
+    institutions         = lookup(Institution, 'legacy_id')
+    authors              = lookup(Author, 'name')
+    image_type_tags      = lookup(ImageTypeTag, 'legacy_id')
+    rock_carving_objects = lookup(RockCarvingObject, 'name')
+    dating_tags          = lookup(DatingTag, 'legacy_id')
+    keyword_tags         = lookup(KeywordTag, 'legacy_id')
+
+    image_keywords = group_keywords(image_keyword_df)
+    sites = resolve_sites(df, cache_dir=cache_dir)
+
+    ImageKeyword = Image.keywords.through
+    ImageDatingTag = Image.dating_tags.through
+
+    start = time.perf_counter()
+    total = 0
+    for chunk_start in range(0, len(df), chunk_size):
+
+        rows = df.iloc[chunk_start:chunk_start + chunk_size].to_dict('records')
+
+        images = []
+        for row in rows:
+
+            date_note = row['Årtal']
+
+            # Files are staged in the MEDIA_ROOT by stage_image_files
+            filepath = os.path.join(IMAGE_DIRECTORY, f"{row['BildId']}.jpg")
+
+            images.append(Image(
+                legacy_id = row['BildId'],
+                file = filepath,
+                site_id = sites.get(site_key(row)),
+                collection_id = collections.get(row['SamlingId']),
+                institution_id = institutions.get(row["InstitutionId"]),
+                author_id = authors.get(row["Fotograf"]),
+                type_id = image_type_tags.get(row['TypId']),
+                year = parse_year(date_note),
+                date_note = date_note,
+                rock_carving_object_id = rock_carving_objects.get(row["Objektnamn"])
+            ))
+
+        with transaction.atomic():
+
+            for image in images:
+                image.save()
+
+            keyword_rows = []
+            dating_rows = []
+            for image, row in zip(images, rows):
+                for keyword_id in image_keywords.get(row['BildId'], []):
+                    if keyword_id in keyword_tags:
+                        keyword_rows.append(ImageKeyword(image_id=image.id, keywordtag_id=keyword_tags[keyword_id]))
+                if row["DateringsId"] in dating_tags:
+                    dating_rows.append(ImageDatingTag(image_id=image.id, datingtag_id=dating_tags[row["DateringsId"]]))
+
+            ImageKeyword.objects.bulk_create(keyword_rows, ignore_conflicts=True)
+            ImageDatingTag.objects.bulk_create(dating_rows, ignore_conflicts=True)
+
+        total += len(images)
+        elapsed = time.perf_counter() - start
+        print(f"{total}/{len(df)} images in {elapsed:.1f} s ({total / elapsed:.0f} rows/s)")
+
+    regions.refresh_region_labels()
+    suggestions.refresh_suggestions()
+    search_cache.bump_generation()
+    site_stats.refresh_site_stats()
+    tag_index.invalidate()
+    tiles.bump_version()
@@ -1,125 +1,201 @@
 from .models import *
 from django.db.models import Q
-from django.contrib.gis.geos import GEOSGeometry
+from django.contrib.gis.geos import GEOSGeometry, MultiPolygon
 import apps.geography.models as geography
-import geojson
-
-parish_country = geography.Country.objects.get(name='SVERIGE')
-
-def socken_model(socken_file):
-    with open(socken_file) as file:
-        input = geojson.load(file)
-        sockson_info = input['features']
-
-        for features in sockson_info:
-            # Parish features
-            # parish_id = features['id']
-            # parish_id = features['properties']['OBJECTID']
-            parish_id = features['properties']['sockenstadkod']
-            geom = features['geometry']
-            if geom['type'] == 'Polygon':
-                geom['type'] = 'MultiPolygon'
-                geom['coordinates'] = [features['geometry']['coordinates']]
-
-            paris_name = features['properties']['sockenstadnamn']
-            parish_code = features['properties']['sockenstadkod']
-            # year = features['properties']['version_giltig_fran']
-            
-            parish,_ = geography.Parish.objects.update_or_create(
-            id = parish_id,
-            code = parish_code,
-            defaults={       
-                    'geometry': GEOSGeometry(str(geom)),
-                    'name': paris_name,
-                    # 'code': parish_code,
-                    'country': parish_country
-                }
-            )
-            parish.save()
-        file.close()
-    # 
-
-def lan_model(lan_file):
-
-    with open(lan_file) as file:
-        input = geojson.load(file)
-        lan_info = input['features']
-
-        for features in lan_info:
-            # lan_id = features['id']
-            # lan_id = features['properties']['FID']
-            lan_id = features['properties']['LANSKOD']
-            lan_name = features['properties']['LANSNAMN']
-            # lan_code = features['properties']['KKOD']
-            lan_code = features['properties']['LANSKOD']
-
-            geom = features['geometry']
-            if geom['type'] == 'Polygon':
-                geom['type'] = 'MultiPolygon'
-                geom['coordinates'] = [features['geometry']['coordinates']]
-
-            province,_ = geography.Province.objects.update_or_create(
-            id = lan_id,
-            defaults={       
-                    'geometry': GEOSGeometry(str(geom)),
-                    'name': lan_name,
-                    'code': lan_code,
-                    'country': parish_country
-                }
-            )
-            province.save()
-        file.close()
+import json
+import re
+
+# Number of features upserted per query
+BATCH_SIZE = 500
+
+# Start of the features array of a FeatureCollection
+FEATURES_PATTERN = re.compile(r'"features"\s*:\s*\[')
+
+
+def get_sweden():
+    """The country of Swedish parishes and provinces, looked up when loading."""
+    return geography.Country.objects.get(name='SVERIGE')
+
+
+def iter_features(path, buffer_size=1 << 20):
+    """Yield the features of a GeoJSON FeatureCollection one at a time.
+
+    The file is read in blocks and each feature decoded as soon as it is
+    complete, so large files are never held in memory as a whole.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(path, "r", encoding="utf-8") as file:
+
+        def read(buffer, pos):
+            # Grow geometrically, so that very large features decode in linear time
+            chunk = file.read(max(buffer_size, len(buffer) - pos))
+            return buffer[pos:] + chunk, bool(chunk)
+
+        buffer, more = read("", 0)
+        match = FEATURES_PATTERN.search(buffer)
+        while not match and more:
+            buffer, more = read(buffer, 0)
+            match = FEATURES_PATTERN.search(buffer)
+        if not match:
+            raise ValueError(f"No features in {path}")
+
+        pos = match.end()
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer):
+                buffer, more = read(buffer, pos)
+                pos = 0
+                if not more:
+                    raise ValueError(f"Unterminated features in {path}")
+                continue
+
+            if buffer[pos] == "]":
+                return
+
+            try:
+                feature, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                buffer, more = read(buffer, pos)
+                pos = 0
+                if not more:
+                    raise
+                continue
+
+            yield feature
+
+
+def to_multipolygon(geometry, tolerance=None) -> MultiPolygon:
+    """GEOS MultiPolygon of a GeoJSON geometry, optionally simplified.
+
+    Simplification preserves topology, so that rings stay valid at the
+    given tolerance (in the units of the geometry).
+    """
+    geom = GEOSGeometry(json.dumps(geometry))
+    if tolerance:
+        geom = geom.simplify(tolerance, preserve_topology=True)
+    if geom.geom_type == 'Polygon':
+        geom = MultiPolygon(geom, srid=geom.srid)
+    return geom
+
+
+def bulk_upsert(model, objs, update_fields, batch_size=BATCH_SIZE):
+    """Insert or update objects by primary key, batch_size rows per query.
+
+    Objects with the same primary key keep the last one, as PostgreSQL
+    cannot update a row twice in one INSERT ... ON CONFLICT.
+    """
+    objs = list({obj.id: obj for obj in objs}.values())
+    for start in range(0, len(objs), batch_size):
+        model.objects.bulk_create(
+            objs[start:start + batch_size],
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=update_fields,
+        )
+    return len(objs)
+
+
+def _upsert_features(model, features, build, update_fields, batch_size):
+    batch = []
+    count = 0
+    for feature in features:
+        batch.append(build(feature))
+        if len(batch) == batch_size:
+            count += bulk_upsert(model, batch, update_fields, batch_size)
+            batch = []
+    return count + bulk_upsert(model, batch, update_fields, batch_size)
+
+
+def socken_model(socken_file, tolerance=None, batch_size=BATCH_SIZE):
+    country = get_sweden()
+
+    def build(features):
+        # Parish features
+        # parish_id = features['id']
+        # parish_id = features['properties']['OBJECTID']
+        parish_id = features['properties']['sockenstadkod']
+        paris_name = features['properties']['sockenstadnamn']
+        parish_code = features['properties']['sockenstadkod']
+        # year = features['properties']['version_giltig_fran']
+
+        return geography.Parish(
+            id=parish_id,
+            code=parish_code,
+            geometry=to_multipolygon(features['geometry'], tolerance),
+            name=paris_name,
+            country=country,
+        )
+
+    return _upsert_features(geography.Parish, iter_features(socken_file), build,
+                            ['code', 'geometry', 'name', 'country'], batch_size)
+
+
+def lan_model(lan_file, tolerance=None, batch_size=BATCH_SIZE):
+    country = get_sweden()
+
+    def build(features):
+        # lan_id = features['id']
+        # lan_id = features['properties']['FID']
+        lan_id = features['properties']['LANSKOD']
+        lan_name = features['properties']['LANSNAMN']
+        # lan_code = features['properties']['KKOD']
+        lan_code = features['properties']['LANSKOD']
+
+        return geography.Province(
+            id=lan_id,
+            geometry=to_multipolygon(features['geometry'], tolerance),
+            name=lan_name,
+            code=lan_code,
+            country=country,
+        )
+
+    return _upsert_features(geography.Province, iter_features(lan_file), build,
+                            ['geometry', 'name', 'code', 'country'], batch_size)
 
 
 def update_parish_province(site_file):
-    with open(site_file) as file:
-        input = geojson.load(file)
-        lan_info = input['features']
-
-        for features in lan_info:
-
-            land_id = features['properties']['LänId']
-            socken_id = features['properties']['Sockenkod']
-            if land_id:
-                try:
-                    province = geography.Province.objects.get(id=land_id)
-                except :
-                    province = geography.Province.objects.update_or_create(
-                        id = features['properties']['LänId'],
-                        name = features['properties']['Län'],
-                        code = features['properties']['LänskodKsamsök'],
-                        country = parish_country
-                    )
-
-            if socken_id:
-                try:    
-                    parish = geography.Parish.objects.get(id=socken_id)
-                except:
-                    parish = geography.Parish.objects.update_or_create(
-                        id = features['properties']['Sockenkod'],
-                        name = features['properties']['Län'],
-                        code = features['properties']['Sockenkod'],
-                        country = parish_country
-                    )
+    parish_country = get_sweden()
 
+    for features in iter_features(site_file):
 
+        land_id = features['properties']['LänId']
+        socken_id = features['properties']['Sockenkod']
+        if land_id:
+            try:
+                province = geography.Province.objects.get(id=land_id)
+            except :
+                province = geography.Province.objects.update_or_create(
+                    id = features['properties']['LänId'],
+                    name = features['properties']['Län'],
+                    code = features['properties']['LänskodKsamsök'],
+                    country = parish_country
+                )
+
+        if socken_id:
+            try:
+                parish = geography.Parish.objects.get(id=socken_id)
+            except:
+                parish = geography.Parish.objects.update_or_create(
+                    id = features['properties']['Sockenkod'],
+                    name = features['properties']['Län'],
+                    code = features['properties']['Sockenkod'],
+                    country = parish_country
+                )
 
-def update_site(site_file):
-    with open(site_file) as file:
-        input = geojson.load(file)
-        lan_info = input['features']
 
-        for features in lan_info:
-            #Site unique info
-            lamn_id = features['properties']['lamningsnr']
-            land_id = features['properties']['LänId']
-            socken_id = features['properties']['Sockenkod']
 
-            if land_id:
-                province = geography.Province.objects.get(id=land_id)
-                parish = geography.Parish.objects.get(id=socken_id)
-                site = Site.objects.filter(lamning_id=lamn_id).update(
-                                                parish= parish,
-                                                province= province)
-            
-            
+def update_site(site_file):
+    for features in iter_features(site_file):
+        #Site unique info
+        lamn_id = features['properties']['lamningsnr']
+        land_id = features['properties']['LänId']
+        socken_id = features['properties']['Sockenkod']
+
+        if land_id:
+            province = geography.Province.objects.get(id=land_id)
+            parish = geography.Parish.objects.get(id=socken_id)
+            site = Site.objects.filter(lamning_id=lamn_id).update(
+                                            parish= parish,
+                                            province= province)
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from apps.shfa import iiif_dimensions
+import time
+
+
+class Command(BaseCommand):
+    help = "Fetch missing image widths and heights from the IIIF server."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("--sweep", action="store_true",
+                            help="Queue every image still missing width or height before processing.")
+        parser.add_argument("--loop", action="store_true",
+                            help="Keep polling the queue instead of exiting when it is empty.")
+        parser.add_argument("--poll-interval", type=float, default=30.0)
+        parser.add_argument("--batch-size", type=int, default=iiif_dimensions.BATCH_SIZE)
+        parser.add_argument("--concurrency", type=int, default=iiif_dimensions.CONCURRENCY)
+        parser.add_argument("--timeout", type=float, default=iiif_dimensions.TIMEOUT)
+        parser.add_argument("--base-url", type=str, default=None,
+                            help="IIIF base URL, e.g. a local stub server. Defaults to IIIF_BASE_URL.")
+
+    def handle(self, **options):
+
+        if options["sweep"]:
+            queued = iiif_dimensions.enqueue_missing()
+            self.stdout.write(f"Queued {queued} images missing dimensions")
+
+        session = iiif_dimensions.make_session(options["concurrency"])
+        total_updated = total_failed = 0
+        start = time.perf_counter()
+
+        while True:
+            claimed, updated, failed = iiif_dimensions.process_batch(
+                session,
+                batch_size=options["batch_size"],
+                concurrency=options["concurrency"],
+                base_url=options["base_url"],
+                timeout=options["timeout"],
+            )
+            total_updated += updated
+            total_failed += failed
+
+            if claimed:
+                self.stdout.write(f"Updated {updated}, failed {failed} of {claimed} queued images")
+                continue
+            if not options["loop"]:
+                break
+            time.sleep(options["poll_interval"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Updated {total_updated} images, {total_failed} failures, "
+            f"in {time.perf_counter() - start:.1f}s"))
@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from apps.shfa import serializers, site_geojson
+from apps.shfa.views import SiteGeoViewSet
+import json
+import time
+
+
+class Command(BaseCommand):
+    help = "Compare the site GeoJSON serializer with the compact encoder on the full site list."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("-r", "--repeat", type=int, default=3,
+                            help="Number of runs of each encoder; the best run is reported.")
+        parser.add_argument("-p", "--precision", type=int, default=site_geojson.PRECISION,
+                            help="Decimals of the coordinates in the compact encoding.")
+        parser.add_argument("--min-speedup", type=float, default=5.0,
+                            help="Fail if the compact encoder is not this many times faster.")
+
+    def best_of(self, repeat, encode):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            content = encode()
+            timings.append(time.perf_counter() - start)
+        return min(timings), content
+
+    def handle(self, **options):
+
+        queryset = SiteGeoViewSet.queryset
+        properties = site_geojson.feature_properties(serializers.SiteGeoSerializer)
+
+        def serialize():
+            data = serializers.SiteGeoSerializer(queryset.all(), many=True).data
+            return JSONRenderer().render(data)
+
+        def encode():
+            chunks = site_geojson.stream_feature_collection(queryset.all(), properties, options["precision"])
+            return "".join(chunks).encode("utf-8")
+
+        serializer_time, expected = self.best_of(options["repeat"], serialize)
+        compact_time, content = self.best_of(options["repeat"], encode)
+
+        expected_count = len(json.loads(expected)["features"])
+        count = len(json.loads(content)["features"])
+        if count != expected_count:
+            raise CommandError(f"The compact encoding has {count} features instead of {expected_count}")
+
+        speedup = serializer_time / compact_time if compact_time else float("inf")
+        self.stdout.write(
+            f"{count} sites: serializer {serializer_time * 1000:.0f} ms ({len(expected) / 1e6:.1f} MB), "
+            f"compact {compact_time * 1000:.0f} ms ({len(content) / 1e6:.1f} MB), {speedup:.1f}x faster")
+        if speedup < options["min_speedup"]:
+            raise CommandError(f"Speedup below {options['min_speedup']:g}x")
+        self.stdout.write(self.style.SUCCESS("Compact encoding is within the target"))
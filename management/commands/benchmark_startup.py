@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from contextlib import ExitStack
+import importlib
+import sys
+import time
+
+# Modules a worker imports when it loads the URL configuration
+MODULES = [
+    "apps.shfa.oai_cat",
+    "apps.shfa.serializers",
+    "apps.shfa.views",
+    "apps.shfa.manifest.views",
+    "apps.shfa.urls",
+]
+
+
+class Command(BaseCommand):
+    help = "Import the SHFA views and URLs with database access blocked, and report the import time."
+
+    # System checks would load the URL configuration before the benchmark
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("-r", "--repeat", type=int, default=1,
+                            help="Number of times to re-import the modules.")
+
+    def handle(self, **options):
+
+        queries = []
+
+        def blocker(execute, sql, params, many, context):
+            queries.append(sql)
+            raise CommandError(f"Database accessed during import: {sql}")
+
+        timings = []
+        for _ in range(options["repeat"]):
+
+            # Drop already imported modules so that they are executed again
+            for module in MODULES:
+                sys.modules.pop(module, None)
+
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(blocker))
+
+                start = time.perf_counter()
+                for module in MODULES:
+                    importlib.import_module(module)
+                timings.append(time.perf_counter() - start)
+
+        if queries:
+            raise CommandError(f"{len(queries)} queries executed during import")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(MODULES)} modules without database access: "
+            f"best {min(timings) * 1000:.1f} ms, worst {max(timings) * 1000:.1f} ms"))
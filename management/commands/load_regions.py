@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from apps.shfa.load_parish_provience import socken_model, lan_model, BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = "Load Swedish parish and province geometries from GeoJSON files."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("-p", "--parishes", type=str,
+                            help="GeoJSON file with the parish (socken) features.")
+        parser.add_argument("-l", "--provinces", type=str,
+                            help="GeoJSON file with the province (län) features.")
+        parser.add_argument("-t", "--tolerance", type=float, default=None,
+                            help="Simplify geometries to this tolerance, in the units of the data.")
+        parser.add_argument("-n", "--batch-size", type=int, default=BATCH_SIZE,
+                            help="Number of features upserted per query.")
+
+    def handle(self, **options):
+
+        if options["parishes"]:
+            count = socken_model(options["parishes"], tolerance=options["tolerance"], batch_size=options["batch_size"])
+            self.stdout.write(f"Loaded {count} parishes")
+
+        if options["provinces"]:
+            count = lan_model(options["provinces"], tolerance=options["tolerance"], batch_size=options["batch_size"])
+            self.stdout.write(f"Loaded {count} provinces")
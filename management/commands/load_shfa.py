@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from apps.shfa.load import load_sites, load_images, load_foreign_tables, load_name_tables, delete_all
+from apps.shfa.load import load_sites, load_images, load_foreign_tables, load_name_tables, delete_all, stage_image_files, CHUNK_SIZE
+from apps.shfa.file_staging import WORKERS
 import os
 
 class Command(BaseCommand):
@@ -8,6 +9,18 @@ class Command(BaseCommand):
         
         parser.add_argument("-s", "--sites", type=str)
         parser.add_argument("-b", "--root", type=str)
+        parser.add_argument("-r", "--resume", action="store_true",
+                            help="Continue an interrupted image import, keeping sites and reference tables.")
+        parser.add_argument("-c", "--chunk-size", type=int, default=CHUNK_SIZE,
+                            help="Number of images inserted per transaction.")
+        parser.add_argument("-w", "--workers", type=int, default=WORKERS,
+                            help="Number of image files staged concurrently.")
+        parser.add_argument("--verify", action="store_true",
+                            help="Verify copied image files against the checksum of the source.")
+        parser.add_argument("--no-link", action="store_true",
+                            help="Always copy image files, never hardlink or reflink them.")
+        parser.add_argument("--fornsok-cache", type=str,
+                            help="Directory caching fetched K-samsök records (default: .fornsok-cache in the root).")
 
     def handle(self, **options):
 
@@ -16,11 +29,16 @@ class Command(BaseCommand):
         image_keyword_path = os.path.join(options["root"], "BildNyckelord.json")
         sites_path = os.path.join(options["sites"])
 
-        delete_all()
-        if sites_path:
-            load_sites(sites_path)
-            
-        load_name_tables(image_path)
-        load_foreign_tables(options["root"])
-        load_images(image_path, image_keyword_path, images_root)
+        if not options["resume"]:
+            delete_all()
+            if sites_path:
+                load_sites(sites_path)
+
+            load_name_tables(image_path)
+            load_foreign_tables(options["root"])
+
+        stage_image_files(image_path, images_root, workers=options["workers"],
+                          verify=options["verify"], link=not options["no_link"])
+        cache_dir = options["fornsok_cache"] or os.path.join(options["root"], ".fornsok-cache")
+        load_images(image_path, image_keyword_path, chunk_size=options["chunk_size"], cache_dir=cache_dir)
 
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from apps.shfa.search_index import refresh_image_index
+from apps.shfa.regions import refresh_region_labels
+from apps.shfa.suggestions import refresh_suggestions
+from apps.shfa import search_cache, tag_index, tiles
+from apps.shfa.site_stats import refresh_site_stats
+import time
+
+
+class Command(BaseCommand):
+    help = "Rebuild the denormalized image search documents, facets, region labels, autocomplete suggestions and site statistics."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("-i", "--ids", type=int, nargs="+",
+                            help="Only rebuild the documents of these image IDs.")
+
+    def handle(self, **options):
+
+        start = time.perf_counter()
+        refresh_image_index(options["ids"])
+        refresh_region_labels()
+        refresh_suggestions()
+        refresh_site_stats()
+        search_cache.bump_generation()
+        tag_index.invalidate()
+        tiles.bump_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Search index rebuilt in {time.perf_counter() - start:.1f}s"))
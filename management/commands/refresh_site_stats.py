@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from apps.shfa.site_stats import refresh_site_stats
+from apps.shfa import tiles
+import time
+
+
+class Command(BaseCommand):
+    help = "Build the per-site statistics read by the site map, vector tiles and clusters."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("-i", "--ids", type=int, nargs="+",
+                            help="Only rebuild the statistics of these site IDs.")
+
+    def handle(self, **options):
+
+        start = time.perf_counter()
+        count = refresh_site_stats(options["ids"])
+        tiles.bump_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Statistics of {count} sites built in {time.perf_counter() - start:.1f}s"))
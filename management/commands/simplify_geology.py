@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from apps.shfa.geology import refresh_simplified_geology, TOLERANCES
+import time
+
+
+class Command(BaseCommand):
+    help = "Precompute the simplified geology polygons served at lower resolutions."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("-i", "--ids", type=int, nargs="+",
+                            help="Only simplify the polygons of these geology IDs.")
+
+    def handle(self, **options):
+
+        start = time.perf_counter()
+        count = refresh_simplified_geology(options["ids"])
+        self.stdout.write(self.style.SUCCESS(
+            f"{count} polygons simplified at {len(TOLERANCES)} resolutions in {time.perf_counter() - start:.1f}s"))
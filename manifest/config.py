@@ -27,4 +27,5 @@ OAI_CONFIG = {
     'COMPRESSION': ['gzip', 'deflate'],
     'DELETED_RECORD': 'persistent',
     'GRANULARITY': 'YYYY-MM-DD',
+    'PAGE_SIZE': getattr(settings, 'OAI_PAGE_SIZE', 25),
 }
\ No newline at end of file
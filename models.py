@@ -1,10 +1,13 @@
 from tabnanny import verbose
 import diana.abstract.models as abstract
 from django.utils.translation import gettext_lazy as _
+from django.utils import timezone
 from django.contrib.gis.db import models
 import apps.geography.models as geography
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
+from django.contrib.postgres.search import SearchVectorField
+from django.contrib.postgres.indexes import GinIndex
 # from django.contrib.postgres.fields import ArrayField
 from django_better_admin_arrayfield.models.fields import ArrayField
 
@@ -406,6 +409,10 @@ class Image(abstract.AbstractTIFFImageModel):
     class Meta:
         verbose_name = _("Image")
         verbose_name_plural = _("Images")
+        indexes = [
+            # Keyset order of the OAI-PMH harvest pages
+            models.Index(fields=["updated_at", "id"], name="shfa_image_updated_id"),
+        ]
 
     def __str__(self) -> str:
         return f"Image {self.file.name} of {self.site}"
@@ -414,6 +421,175 @@ class Image(abstract.AbstractTIFFImageModel):
         return str(self)
 
 
+class ImageSearchDocument(models.Model):
+    # Denormalized search document for an image, one row per image.
+    # Maintained by search_index.refresh_image_index, never edited by hand.
+
+    image = models.OneToOneField(Image, primary_key=True, on_delete=models.CASCADE, related_name="search_document", verbose_name=_(
+        "Image"), help_text=_("Image the search document describes."))
+
+    # Per-source texts, Swedish and English forms together
+    site_text = models.TextField(blank=True, default="", verbose_name=_("Site text"))
+    keyword_text = models.TextField(blank=True, default="", verbose_name=_("Keyword text"))
+    people_text = models.TextField(blank=True, default="", verbose_name=_("People text"))
+    dating_text = models.TextField(blank=True, default="", verbose_name=_("Dating text"))
+    type_text = models.TextField(blank=True, default="", verbose_name=_("Type text"))
+    institution_text = models.TextField(blank=True, default="", verbose_name=_("Institution text"))
+    region_text = models.TextField(blank=True, default="", verbose_name=_("Region text"))
+    carving_text = models.TextField(blank=True, default="", verbose_name=_("Rock carving text"))
+
+    # Whole document per language, used for free-text search and ranking
+    text_sv = models.TextField(blank=True, default="", verbose_name=_("Swedish document"))
+    text_en = models.TextField(blank=True, default="", verbose_name=_("English document"))
+    search_vector = SearchVectorField(null=True, blank=True, verbose_name=_("Search vector"))
+
+    class Meta:
+        verbose_name = _("Image search document")
+        verbose_name_plural = _("Image search documents")
+        indexes = [
+            GinIndex(fields=["search_vector"], name="shfa_isd_vector_gin"),
+            GinIndex(fields=["text_sv"], name="shfa_isd_text_sv_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["text_en"], name="shfa_isd_text_en_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["site_text"], name="shfa_isd_site_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["keyword_text"], name="shfa_isd_keyword_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["people_text"], name="shfa_isd_people_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["dating_text"], name="shfa_isd_dating_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["type_text"], name="shfa_isd_type_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["institution_text"], name="shfa_isd_institution_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["region_text"], name="shfa_isd_region_trgm", opclasses=["gin_trgm_ops"]),
+            GinIndex(fields=["carving_text"], name="shfa_isd_carving_trgm", opclasses=["gin_trgm_ops"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"Search document of image {self.image_id}"
+
+
+class ImageFacets(models.Model):
+    # Precomputed facet membership of an image, one narrow row per image,
+    # so that all summary facets can be counted in a single scan.
+    # Maintained by search_index.refresh_image_index.
+
+    image = models.OneToOneField(Image, primary_key=True, on_delete=models.CASCADE, related_name="facets", verbose_name=_(
+        "Image"), help_text=_("Image the facets describe."))
+    site_id = models.BigIntegerField(null=True, blank=True, verbose_name=_("Site"))
+    type_id = models.BigIntegerField(null=True, blank=True, verbose_name=_("Type"))
+    institution_id = models.BigIntegerField(null=True, blank=True, verbose_name=_("Institution"))
+    year = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("Creation year"))
+    people_ids = ArrayField(models.BigIntegerField(), default=list, blank=True, verbose_name=_("People"))
+    keyword_ids = ArrayField(models.BigIntegerField(), default=list, blank=True, verbose_name=_("Keywords"))
+
+    class Meta:
+        verbose_name = _("Image facets")
+        verbose_name_plural = _("Image facets")
+
+    def __str__(self) -> str:
+        return f"Facets of image {self.image_id}"
+
+
+class ImageDimensionTask(models.Model):
+    # Durable queue entry for an image whose width and height are still
+    # to be read from its IIIF info.json, see iiif_dimensions.py
+
+    image = models.OneToOneField(Image, primary_key=True, on_delete=models.CASCADE, related_name="dimension_task", verbose_name=_(
+        "Image"), help_text=_("Image missing width or height."))
+    enqueued_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Enqueued at"))
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name=_(
+        "Next attempt at"), help_text=_("The task is not picked up by a worker before this time."))
+    attempts = models.PositiveIntegerField(default=0, verbose_name=_("Attempts"))
+    last_error = models.TextField(blank=True, default="", verbose_name=_("Last error"))
+
+    class Meta:
+        verbose_name = _("Image dimension task")
+        verbose_name_plural = _("Image dimension tasks")
+
+    def __str__(self) -> str:
+        return f"Dimensions of image {self.image_id}"
+
+
+class RegionLabel(models.Model):
+    # Region dimension for region search, one row per distinct region of
+    # the sites with images, see regions.py
+
+    label = models.CharField(max_length=1024, unique=True, verbose_name=_(
+        "Label"), help_text=_("Display label, from the parish to the country."))
+    parish = models.CharField(max_length=256, null=True, blank=True, verbose_name=_("Parish"))
+    municipality = models.CharField(max_length=256, null=True, blank=True, verbose_name=_("Municipality"))
+    province = models.CharField(max_length=256, null=True, blank=True, verbose_name=_("Province"))
+    country = models.CharField(max_length=256, null=True, blank=True, verbose_name=_("Country"))
+    search_text = models.TextField(blank=True, default="", verbose_name=_(
+        "Search text"), help_text=_("Every region name the label is found by."))
+    image_count = models.PositiveIntegerField(default=0, verbose_name=_("Number of images"))
+    site_count = models.PositiveIntegerField(default=0, verbose_name=_("Number of sites"))
+
+    class Meta:
+        verbose_name = _("Region label")
+        verbose_name_plural = _("Region labels")
+        indexes = [
+            GinIndex(fields=["search_text"], name="shfa_regionlabel_trgm", opclasses=["gin_trgm_ops"]),
+        ]
+
+    def __str__(self) -> str:
+        return self.label
+
+
+class SearchSuggestion(models.Model):
+    # Autocomplete index, one row per distinct vocabulary term and source,
+    # see suggestions.py
+
+    term = models.CharField(max_length=512, verbose_name=_("Term"))
+    normalized = models.CharField(max_length=512, verbose_name=_(
+        "Normalized term"), help_text=_("Lowercased term, used for matching."))
+    source = models.CharField(max_length=32, verbose_name=_(
+        "Source"), help_text=_("Vocabulary the term comes from, e.g. keywords or site."))
+    image_count = models.PositiveIntegerField(default=0, verbose_name=_("Number of images"))
+
+    class Meta:
+        verbose_name = _("Search suggestion")
+        verbose_name_plural = _("Search suggestions")
+        constraints = [
+            models.UniqueConstraint(fields=["term", "source"], name="shfa_suggestion_term_source"),
+        ]
+        indexes = [
+            models.Index(fields=["normalized"], name="shfa_suggestion_prefix", opclasses=["varchar_pattern_ops"]),
+            GinIndex(fields=["normalized"], name="shfa_suggestion_trgm", opclasses=["gin_trgm_ops"]),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.term} ({self.source})"
+
+
+class SiteStats(models.Model):
+    # Precomputed facts of a site, one row per site, see site_stats.py
+
+    site = models.OneToOneField(Site, primary_key=True, on_delete=models.CASCADE, related_name="stats", verbose_name=_(
+        "Site"))
+    label = models.CharField(max_length=512, blank=True, default="", verbose_name=_(
+        "Label"), help_text=_("Display label of the site."))
+    image_count = models.PositiveIntegerField(default=0, verbose_name=_(
+        "Number of images"), help_text=_("Number of published images."))
+    total_image_count = models.PositiveIntegerField(default=0, verbose_name=_(
+        "Total number of images"), help_text=_("Number of images, published or not."))
+    group_image_count = models.PositiveIntegerField(default=0, verbose_name=_(
+        "Number of grouped images"), help_text=_("Number of images in a visualisation group."))
+    visualization_group_count = models.PositiveIntegerField(default=0, verbose_name=_(
+        "Number of 3D models"))
+    type_ids = ArrayField(models.BigIntegerField(), default=list, blank=True, verbose_name=_(
+        "Image types"), help_text=_("Types of the published images."))
+    min_year = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("First year"))
+    max_year = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("Last year"))
+
+    class Meta:
+        verbose_name = _("Site statistics")
+        verbose_name_plural = _("Site statistics")
+        indexes = [
+            models.Index(fields=["total_image_count"], name="shfa_sitestats_images"),
+            models.Index(fields=["visualization_group_count"], name="shfa_sitestats_3d"),
+        ]
+
+    def __str__(self) -> str:
+        return f"Statistics of site {self.site_id}"
+
+
 class Compilation(abstract.AbstractBaseModel):
 
     # A manual compilation of images, could be used for display
@@ -483,6 +659,30 @@ class Geology(abstract.AbstractBaseModel):
         return self.type
 
 
+class SimplifiedGeology(models.Model):
+    # Precomputed simplified polygons of a geology, one row per resolution,
+    # see geology.py
+
+    geology = models.ForeignKey(Geology, on_delete=models.CASCADE, related_name="simplified", verbose_name=_(
+        "Geology"))
+    resolution = models.PositiveSmallIntegerField(verbose_name=_(
+        "Resolution"), help_text=_("Resolution level, higher is coarser."))
+    tolerance = models.FloatField(verbose_name=_(
+        "Tolerance"), help_text=_("Simplification tolerance in degrees."))
+    coordinates = models.PolygonField(null=True, blank=True, verbose_name=_(
+        "Polygon"), help_text=_("Simplified polygon coordinates of the geology"))
+
+    class Meta:
+        verbose_name = _("Simplified geology")
+        verbose_name_plural = _("Simplified geologies")
+        constraints = [
+            models.UniqueConstraint(fields=["geology", "resolution"], name="shfa_simplifiedgeology_unique"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.geology} ({self.resolution})"
+
+
 class CameraLens(abstract.AbstractBaseModel):
     name = models.CharField(max_length=256, verbose_name=_(
         "Lens"), help_text=_("Lens of the camera"))
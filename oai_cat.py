@@ -1,10 +1,19 @@
 from django.shortcuts import render
+from django.http import StreamingHttpResponse
+from django.template.loader import get_template
+from django.db.models import Q, Prefetch
+from django.core import signing
 from . import models
+from .manifest.config import OAI_CONFIG
 from django.utils import timezone
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.core.paginator import Paginator, EmptyPage
 
-NUM_PER_PAGE = 25
+NUM_PER_PAGE = OAI_CONFIG['PAGE_SIZE']
+
+# Resumption tokens are signed with the SECRET_KEY and expire after a day
+RESUMPTION_TOKEN_SALT = "shfa.oai_cat.resumption_token"
+RESUMPTION_TOKEN_MAX_AGE = timedelta(days=1)
 
 
 def get_records(params, request):
@@ -81,28 +90,126 @@ def get_identify(request):
     return identify_output
 
 
+def _records_queryset(from_timestamp=None, until_timestamp=None):
+    """Images with every relation rendered in a ListRecords record, in keyset order."""
+    images_data = (
+        models.Image.objects
+        .select_related(
+            'site__parish',
+            'site__province',
+            'site__municipality__superregion__superregion__superregion__superregion',
+            'type', 'subtype', 'institution', 'collection', 'author', 'rock_carving_object',
+        )
+        .prefetch_related(
+            'keywords',
+            Prefetch('people', queryset=models.People.objects.order_by('id')),
+            'dating_tags',
+        )
+        .order_by('updated_at', 'id')
+    )
+    if from_timestamp:
+        images_data = images_data.filter(created_at__gte=from_timestamp)
+    if until_timestamp:
+        images_data = images_data.filter(updated_at__lte=until_timestamp)
+    return images_data
+
+
+def _encode_resumption_token(state) -> str:
+    """Signed, self-contained resumption token for a harvest position."""
+    return signing.dumps(state, salt=RESUMPTION_TOKEN_SALT, compress=True)
+
+
+def _decode_resumption_token(token):
+    """Harvest position of a resumption token.
+
+    Raises signing.SignatureExpired or signing.BadSignature for expired or
+    tampered tokens.
+    """
+    return signing.loads(token, salt=RESUMPTION_TOKEN_SALT, max_age=RESUMPTION_TOKEN_MAX_AGE)
+
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _list_records_page(state):
+    """One page of records after the keyset position of a harvest state.
+
+    Records are ordered by (updated_at, id), so resuming is a range scan
+    rather than an OFFSET, and records edited during a harvest move to the
+    end of the list instead of shifting the following pages.
+
+    Returns:
+        tuple: The records of the page and the resumption token element
+        (None if the list is not split)
+    """
+    images_data = _records_queryset(
+        _parse_timestamp(state["from"]),
+        _parse_timestamp(state["until"]),
+    )
+
+    if state.get("size") is None:
+        state["size"] = images_data.count()
+
+    if state.get("id") is not None:
+        updated_at = _parse_timestamp(state["updated_at"])
+        images_data = images_data.filter(
+            Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=state["id"])
+        )
+
+    images = list(images_data[:NUM_PER_PAGE + 1])
+    has_next = len(images) > NUM_PER_PAGE
+    images = images[:NUM_PER_PAGE]
+
+    token = None
+    if has_next or state["cursor"]:
+        token = {
+            "value": "",
+            "expiration_date": None,
+            "complete_list_size": state["size"],
+            "cursor": state["cursor"],
+        }
+    if has_next:
+        last = images[-1]
+        token["value"] = _encode_resumption_token({
+            **state,
+            "updated_at": last.updated_at.isoformat(),
+            "id": last.id,
+            "cursor": state["cursor"] + len(images),
+        })
+        token["expiration_date"] = timezone.now() + RESUMPTION_TOKEN_MAX_AGE
+    return images, token
+
+
+def _stream_list_records(head_context, record_template, images, token):
+    """Render the ListRecords envelope once and each record as it is produced."""
+    yield get_template("../templates/listrecords_head.xml").render(head_context)
+
+    record = get_template(record_template)
+    for image in images:
+        yield record.render({"image": image})
+
+    yield get_template("../templates/listrecords_tail.xml").render({"token": token})
+
+
 def get_list_records(verb, request, params):
-    template_ksamsok = "../templates/listrecords.xml"
-    template_ariande = "../templates/listrecords_ariadne.xml"
+    template_ksamsok = "../templates/listrecords_record.xml"
+    template_ariande = "../templates/listrecords_ariadne_record.xml"
     error_template = "../templates/error.xml"
     errors = []
 
-    paginator_images = None
-    images = None
+    state = None
     resumption_token = None
     metadata_prefix = None
     from_timestamp = None
     until_timestamp = None
 
     if "resumptionToken" in params:
-        (
-            paginator_images,
-            images,
-            resumption_token,
-            metadata_prefix,
-            from_timestamp,
-            until_timestamp,
-        ) = _do_resumption_token(params, errors)
+        resumption_token, state = _do_resumption_token(params, errors)
+        if state:
+            metadata_prefix = state["prefix"]
+            from_timestamp = _parse_timestamp(state["from"])
+            until_timestamp = _parse_timestamp(state["until"])
 
     elif "metadataPrefix" in params:
         metadata_prefix = params.pop("metadataPrefix")
@@ -112,15 +219,15 @@ def get_list_records(verb, request, params):
                 errors.append(_error("cannotDisseminateFormat", metadata_prefix))
             else:
                 from_timestamp, until_timestamp = _check_timestamps(errors, params)
-
-                images_data = models.Image.objects.all()
-                if from_timestamp:
-                    images_data = images_data.filter(created_at__gte=from_timestamp)
-                if until_timestamp:
-                    images_data = images_data.filter(updated_at__lte=until_timestamp)
-
-                paginator_images = Paginator(images_data, NUM_PER_PAGE)
-                images = paginator_images.page(1)
+                state = {
+                    "prefix": metadata_prefix,
+                    "from": from_timestamp.isoformat() if from_timestamp else None,
+                    "until": until_timestamp.isoformat() if until_timestamp else None,
+                    "updated_at": None,
+                    "id": None,
+                    "cursor": 0,
+                    "size": None,
+                }
         else:
             errors.append(_error("badArgument_single", ";".join(metadata_prefix)))
             metadata_prefix = None
@@ -142,17 +249,17 @@ def get_list_records(verb, request, params):
     else:
         template = template_ksamsok  # fallback default
 
-    return render(
-        request,
-        template_name=template,
-        context={
-            "images": images,
-            "paginator": paginator_images,
-            "resumption_token": resumption_token,
-            "metadata_prefix": metadata_prefix,
-            "from_timestamp": from_timestamp,
-            "until_timestamp": until_timestamp,
-        },
+    images, token = _list_records_page(state)
+
+    head_context = {
+        "verb": verb,
+        "resumption_token": resumption_token,
+        "metadata_prefix": metadata_prefix,
+        "from_timestamp": from_timestamp,
+        "until_timestamp": until_timestamp,
+    }
+    return StreamingHttpResponse(
+        _stream_list_records(head_context, template, images, token),
         content_type="text/xml",
     )
 
@@ -235,59 +342,22 @@ def get_list_set(request, params):
 
 
 def _do_resumption_token(params, errors):
-    metadata_prefix = None
-    from_timestamp = None
-    until_timestamp = None
-    resumption_token = None
-
-    if "resumptionToken" in params:
-        resumption_token = params.pop("resumptionToken")[-1]
-        try:
-            rt = models.ResumptionToken.objects.get(token=resumption_token)
-            if timezone.now() > rt.expiration_date:
-                errors.append(_error(
-                    "badResumptionToken_expired.", resumption_token))
-            else:
-                images_data = models.Image.objects
-                if from_timestamp is not None:
-                    images_data = images_data.filter(created_at__gte=from_timestamp)
-                if until_timestamp is not None:
-                    images_data = images_data.filter(updated_at__gte=until_timestamp)
-
-                try:
-                    paginator = Paginator(images_data.all(), NUM_PER_PAGE)
-                    images = paginator.page(rt.cursor / NUM_PER_PAGE + 1)
-
-                except EmptyPage:
-                    errors.append(_error(
-                        "badResumptionToken", resumption_token))
-
-        except models.ResumptionToken.DoesNotExist:
-            images_data = models.Image.objects
-            paginator = Paginator(images_data, NUM_PER_PAGE)
-            images = paginator.page(1)
-            errors.append(_error(
-                "badResumptionToken", resumption_token))
-
-        # check_bad_arguments(
-        #     params,
-        #     errors,
-        #     msg="The usage of resumptionToken allows no other arguments.",
-        # )
-    else:
-        images_data = models.Image.objects
-        paginator = Paginator(images_data, NUM_PER_PAGE)
-        images = paginator.page(1)
-        
-
-    return (
-        paginator,
-        images,
-        resumption_token,
-        metadata_prefix,
-        from_timestamp,
-        until_timestamp,
-    )
+    resumption_token = params.pop("resumptionToken")[-1]
+    state = None
+    try:
+        state = _decode_resumption_token(resumption_token)
+    except signing.SignatureExpired:
+        errors.append(_error("badResumptionToken_expired", resumption_token))
+    except signing.BadSignature:
+        errors.append(_error("badResumptionToken", resumption_token))
+
+    # check_bad_arguments(
+    #     params,
+    #     errors,
+    #     msg="The usage of resumptionToken allows no other arguments.",
+    # )
+
+    return resumption_token, state
 
 
 def _check_timestamps(errors, params):
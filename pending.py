@@ -0,0 +1,40 @@
+from django.db import connection, transaction
+
+
+class _Batch:
+
+    def __init__(self, key, callback, batches):
+        self.key = key
+        self.callback = callback
+        self.batches = batches
+        self.items = set()
+
+    def run(self):
+        if self.batches.get(self.key) is self:
+            del self.batches[self.key]
+        self.callback(self.items)
+
+
+def _registered(batch) -> bool:
+    # Callbacks of rolled back transactions are dropped by Django
+    return any(entry[1] == batch.run for entry in connection.run_on_commit)
+
+
+def schedule(key, callback, items=()):
+    """Call callback once with the items collected under key, when the
+    current transaction commits.
+
+    Every schedule of the same key within a transaction adds to a single
+    callback, so that N saves in one transaction cause one refresh.
+    Outside of a transaction the callback runs immediately.
+    """
+    if not connection.in_atomic_block:
+        callback(set(items))
+        return
+
+    batches = connection.__dict__.setdefault("_shfa_pending_batches", {})
+    batch = batches.get(key)
+    if batch is None or not _registered(batch):
+        batch = batches[key] = _Batch(key, callback, batches)
+        transaction.on_commit(batch.run)
+    batch.items.update(items)
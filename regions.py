@@ -0,0 +1,139 @@
+from django.db import transaction
+from django.db.models import Count, Q
+from functools import reduce
+from . import models, pending
+
+# Country of a site is taken from the province, or from the top of the
+# administrative unit hierarchy for sites outside of Sweden
+SUPERREGION_NAME = "site__municipality__superregion__superregion__superregion__superregion__name"
+
+# Separator between the names in the search text
+SEPARATOR = " | "
+
+
+def region_label(parish, municipality, province, country):
+    """Display label of a region, or None if it has no meaningful data."""
+    if parish and municipality and province and country:
+        return f"{parish}, {municipality}, {province}, {country}"
+    elif municipality and province and country:
+        return f"{municipality}, {province}, {country}"
+    elif province and country:
+        return f"{province}, {country}"
+    elif municipality and country:
+        return f"{municipality}, {country}"
+    elif country:
+        return country
+    return None
+
+
+# Fields that identify a region for a partial rebuild. Labels without the
+# parish are shared by the sites of all parishes of a municipality or
+# province, so regions are rebuilt by municipality and province.
+REGION_FIELDS = ("municipality", "province")
+
+
+def _regions_q(regions, prefix=""):
+    """Q object matching (municipality, province) name pairs."""
+    conditions = []
+    for names in regions:
+        condition = Q()
+        for field, name in zip(REGION_FIELDS, names):
+            lookup = f"{prefix}{field}__name" if prefix else field
+            condition &= Q(**{f"{lookup}__isnull": True}) if name is None else Q(**{lookup: name})
+        conditions.append(condition)
+    return reduce(lambda x, y: x | y, conditions)
+
+
+def refresh_region_labels(regions=None) -> int:
+    """Rebuild the region labels from the sites that have images.
+
+    The regions and their image and site counts are read with one grouped
+    query, and the labels are replaced in a single transaction. Given
+    (municipality, province) name pairs, only the labels of those regions
+    are rebuilt. Returns the number of labels.
+    """
+    rows = models.Image.objects.filter(site__isnull=False)
+    if regions is not None:
+        if not regions:
+            return 0
+        rows = rows.filter(_regions_q(regions, prefix="site__"))
+
+    rows = (
+        rows
+        .values(
+            'site__parish__name',
+            'site__municipality__name',
+            'site__province__name',
+            'site__province__country__name',
+            SUPERREGION_NAME,
+        )
+        .annotate(images=Count('id'), sites=Count('site', distinct=True))
+        .order_by()
+    )
+
+    labels = {}
+    names = {}
+    for row in rows:
+        parish = row['site__parish__name']
+        municipality = row['site__municipality__name']
+        province = row['site__province__name']
+        country = row['site__province__country__name'] or row[SUPERREGION_NAME]
+
+        label = region_label(parish, municipality, province, country)
+        if not label:
+            continue
+
+        if label not in labels:
+            labels[label] = models.RegionLabel(
+                label=label,
+                parish=parish,
+                municipality=municipality,
+                province=province,
+                country=country,
+            )
+            names[label] = []
+        labels[label].image_count += row['images']
+        labels[label].site_count += row['sites']
+
+        # Sites are also found by the names that are not part of the label
+        names[label].extend(n for n in (
+            parish, municipality, province, row['site__province__country__name'], row[SUPERREGION_NAME],
+        ) if n and n not in names[label])
+
+    for label, region in labels.items():
+        region.search_text = SEPARATOR.join(names[label])
+
+    with transaction.atomic():
+        stale = models.RegionLabel.objects.all()
+        if regions is not None:
+            stale = stale.filter(_regions_q(regions))
+        stale.delete()
+        models.RegionLabel.objects.bulk_create(labels.values())
+
+    return len(labels)
+
+
+def refresh_changed_regions(changes):
+    """Rebuild the labels of the regions touched by changes, given as
+    ("site", site ID) or ("region", (municipality ID, province ID))."""
+    pairs = {value for kind, value in changes if kind == "region"}
+    site_ids = {value for kind, value in changes if kind == "site" and value is not None}
+    if site_ids:
+        pairs.update(models.Site.objects.filter(id__in=site_ids).values_list(
+            *[f"{field}_id" for field in REGION_FIELDS]))
+
+    # Region names by ID, one query per level
+    names = []
+    for level, field in enumerate(REGION_FIELDS):
+        model = models.Site._meta.get_field(field).related_model
+        ids = {pair[level] for pair in pairs if pair[level] is not None}
+        names.append(dict(model.objects.filter(id__in=ids).values_list('id', 'name')))
+
+    regions = {tuple(names[level].get(pk) for level, pk in enumerate(pair)) for pair in pairs}
+    return refresh_region_labels(regions)
+
+
+def schedule_refresh(changes):
+    """Rebuild the labels of the regions touched by changes once the current
+    transaction commits, with one rebuild per transaction."""
+    pending.schedule("region-labels", refresh_changed_regions, changes)
@@ -0,0 +1,187 @@
+from array import array
+from itertools import accumulate
+from django.conf import settings
+from django.contrib.gis.db.models import Extent
+from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from . import models, pending
+import hashlib
+import json
+import math
+import zlib
+
+# Query parameters that select a page of results, not the result set
+PAGINATION_PARAMS = {"page", "limit", "cursor", "cursor_ordering", "format"}
+
+# Query parameters only setting how the bounding box is rounded
+VIEWPORT_PARAMS = {"precision", "zoom"}
+
+# Operator parameters, compared case-insensitively
+OPERATOR_PARAMS = {"operator", "author_operator", "keyword_operator", "dating_operator"}
+
+# Bounding boxes are rounded outwards to this many decimals (about 10 m),
+# or fewer when the client asks for a coarser precision or zoom level
+BBOX_PRECISION = 4
+
+# Decimals of the bounding box per map zoom level
+ZOOM_PRECISION_FACTOR = 0.3
+
+# Counter bumped whenever images, tags or sites change; it is part of every
+# cache key, so a bump invalidates all cached searches at once
+GENERATION_KEY = "shfa:search:generation"
+
+
+def bbox_precision(params) -> int:
+    """Decimals the bounding box of a request is rounded to.
+
+    Taken from the "precision" parameter, or derived from the map "zoom"
+    level, and never finer than BBOX_PRECISION.
+    """
+    try:
+        if params.get("precision"):
+            precision = int(params["precision"])
+        elif params.get("zoom"):
+            precision = round(float(params["zoom"]) * ZOOM_PRECISION_FACTOR)
+        else:
+            return BBOX_PRECISION
+    except ValueError:
+        return BBOX_PRECISION
+    return min(max(precision, 0), BBOX_PRECISION)
+
+
+def parse_bbox(value):
+    """Bounding box of a "xmin,ymin,xmax,ymax" value.
+
+    Returns None if the value does not have four coordinates, and raises
+    ValueError for coordinates that are not numbers.
+    """
+    coords = [float(v) for v in value.split(",")]
+    return coords if len(coords) == 4 else None
+
+
+def round_bbox(value, precision=BBOX_PRECISION):
+    """Bounding box rounded outwards to the given number of decimals, see parse_bbox."""
+    coords = parse_bbox(value)
+    if coords is None:
+        return None
+    factor = 10 ** precision
+    return [
+        math.floor(coords[0] * factor) / factor,
+        math.floor(coords[1] * factor) / factor,
+        math.ceil(coords[2] * factor) / factor,
+        math.ceil(coords[3] * factor) / factor,
+    ]
+
+
+def _canonical_value(key, value, precision):
+    if key in OPERATOR_PARAMS:
+        return value.upper()
+    if key == "in_bbox":
+        try:
+            bbox = round_bbox(value, precision)
+        except ValueError:
+            return value
+        return ",".join(map(str, bbox)) if bbox else value
+    return value
+
+
+def canonical_params(params, exclude=()):
+    """Canonical form of the result-affecting query parameters.
+
+    Keys and values are sorted, blank values dropped, operators upper-cased
+    and bounding boxes rounded to the requested precision, so that
+    equivalent searches map to the same cache entry.
+    """
+    precision = bbox_precision(params)
+    canonical = []
+    for key in sorted(params.keys()):
+        if key in PAGINATION_PARAMS or key in VIEWPORT_PARAMS or key in exclude:
+            continue
+        values = sorted(_canonical_value(key, v.strip(), precision) for v in params.getlist(key) if v and v.strip())
+        if values:
+            canonical.append((key, values))
+    return canonical
+
+
+def generation():
+    return cache.get(GENERATION_KEY, 0)
+
+
+def bump_generation():
+    """Invalidate every cached search result and count."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def schedule_bump():
+    """Bump the generation once the current transaction commits, once per transaction."""
+    pending.schedule("search-generation", lambda _: bump_generation())
+
+
+def search_cache_key(prefix, params, exclude=(), **extra):
+    """Cache key for a search, derived from its canonical parameters."""
+    canonical = canonical_params(params, exclude) + sorted(extra.items())
+    digest = hashlib.sha1(
+        json.dumps(canonical, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    return f"shfa:{prefix}:{generation()}:{digest}"
+
+
+def pack_ids(ids) -> bytes:
+    """Sorted IDs as zlib-compressed 64-bit deltas."""
+    deltas = array('q')
+    previous = 0
+    for pk in ids:
+        deltas.append(pk - previous)
+        previous = pk
+    return zlib.compress(deltas.tobytes())
+
+
+def unpack_ids(data) -> list:
+    deltas = array('q')
+    deltas.frombytes(zlib.decompress(data))
+    return list(accumulate(deltas))
+
+
+def get_ids(key):
+    """Cached sorted ID list, or None."""
+    data = cache.get(key)
+    return None if data is None else unpack_ids(data)
+
+
+def set_ids(key, ids):
+    cache.set(key, pack_ids(ids), getattr(settings, 'SHFA_SEARCH_CACHE_TIMEOUT', 60 * 10))
+
+
+def ids_q(ids, field="id") -> Q:
+    """Q object restricting a field to a list of IDs, passed as one array parameter."""
+    return Q(**{f"{field}__in": RawSQL("SELECT unnest(%s::bigint[])", [list(ids)])})
+
+
+def site_extent():
+    """Extent of all site coordinates, cached until the generation changes."""
+    key = f"shfa:site-extent:{generation()}"
+    extent = cache.get(key)
+    if extent is None:
+        extent = models.Site.objects.aggregate(extent=Extent('coordinates'))['extent'] or ()
+        cache.set(key, extent, getattr(settings, 'SHFA_SEARCH_CACHE_TIMEOUT', 60 * 10))
+    return extent
+
+
+def bbox_q(coords, field="site__coordinates") -> Q:
+    """Q object selecting the points of a field within a bounding box.
+
+    Points are compared with the bounding box operator (&&), which is exact
+    for points and answered from the GiST index in the same join. A box
+    covering every site skips the geometry test and only requires
+    coordinates.
+    """
+    extent = site_extent()
+    if (extent and coords[0] <= extent[0] and coords[1] <= extent[1]
+            and coords[2] >= extent[2] and coords[3] >= extent[3]):
+        return Q(**{f"{field}__isnull": False})
+    return Q(**{f"{field}__bboverlaps": Polygon.from_bbox(coords)})
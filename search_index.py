@@ -0,0 +1,196 @@
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import transaction
+from django.db.models import Q, Prefetch
+from . import models, pending
+
+# Number of images rebuilt per round-trip
+CHUNK_SIZE = 500
+
+# Separator between values in a document column, so that an
+# icontains match cannot span two different values
+SEPARATOR = " | "
+
+# Document column for each advanced search parameter
+DOCUMENT_FIELDS = {
+    "site_name": "site_text",
+    "keyword": "keyword_text",
+    "author_name": "people_text",
+    "dating_tag": "dating_text",
+    "image_type": "type_text",
+    "institution_name": "institution_text",
+    "region_name": "region_text",
+    "rock_carving_object": "carving_text",
+}
+
+
+def _join(*values):
+    return SEPARATOR.join(str(v).strip() for v in values if v not in (None, "") and str(v).strip())
+
+
+def _region_names(site):
+    if not site:
+        return []
+
+    names = []
+    if site.parish:
+        names.append(site.parish.name)
+    if site.municipality:
+        names.append(site.municipality.name)
+        superregion = site.municipality
+        for _ in range(4):
+            superregion = getattr(superregion, "superregion", None) if superregion else None
+        if superregion:
+            names.append(superregion.name)
+    if site.province:
+        names.append(site.province.name)
+        if site.province.country:
+            names.append(site.province.country.name)
+    return names
+
+
+def build_document(image) -> models.ImageSearchDocument:
+    """Build the (unsaved) search document of an image.
+
+    Expects the image to be fetched through get_document_queryset, so that
+    no additional queries are issued.
+    """
+    site = image.site
+    keywords = list(image.keywords.all())
+    people = list(image.people.all())
+    datings = list(image.dating_tags.all())
+
+    site_sv = [site.raa_id, site.lamning_id, site.askeladden_id, site.lokalitet_id,
+               site.placename, site.ksamsok_id] if site else []
+    keyword_sv = [v for k in keywords for v in (k.text, k.category)]
+    keyword_en = [v for k in keywords for v in (k.english_translation, k.category_translation)]
+    people_sv = [p.name for p in people]
+    people_en = [p.english_translation for p in people]
+    dating_sv = [d.text for d in datings]
+    dating_en = [d.english_translation for d in datings]
+    type_sv = [image.type.text] if image.type else []
+    type_en = [image.type.english_translation] if image.type else []
+    institution = [image.institution.name] if image.institution else []
+    region = _region_names(site)
+    carving = [image.rock_carving_object.name] if image.rock_carving_object else []
+    group = [image.group.text] if image.group else []
+
+    return models.ImageSearchDocument(
+        image_id=image.id,
+        site_text=_join(*site_sv),
+        keyword_text=_join(*keyword_sv, *keyword_en),
+        people_text=_join(*people_sv, *people_en),
+        dating_text=_join(*dating_sv, *dating_en),
+        type_text=_join(*type_sv, *type_en),
+        institution_text=_join(*institution),
+        region_text=_join(*region),
+        carving_text=_join(*carving),
+        text_sv=_join(*site_sv, *keyword_sv, *people_sv, *dating_sv, *type_sv,
+                      *institution, *region, *carving, *group, image.year),
+        text_en=_join(*keyword_en, *people_en, *dating_en, *type_en),
+    )
+
+
+def build_facets(image) -> models.ImageFacets:
+    """Build the (unsaved) facet row of an image."""
+    return models.ImageFacets(
+        image_id=image.id,
+        site_id=image.site_id,
+        type_id=image.type_id,
+        institution_id=image.institution_id,
+        year=image.year,
+        people_ids=sorted(p.id for p in image.people.all()),
+        keyword_ids=sorted(k.id for k in image.keywords.all()),
+    )
+
+
+def _upsert(model, objs):
+    model.objects.bulk_create(
+        objs,
+        update_conflicts=True,
+        unique_fields=['image'],
+        update_fields=[f.name for f in model._meta.concrete_fields
+                       if f.name not in ('image', 'search_vector')],
+    )
+
+
+def get_document_queryset():
+    """Images with every relation needed by build_document."""
+    return (
+        models.Image.objects
+        .select_related(
+            'site__parish',
+            'site__province__country',
+            'site__municipality__superregion__superregion__superregion__superregion',
+            'type', 'institution', 'rock_carving_object', 'group',
+        )
+        .prefetch_related(
+            Prefetch('keywords', queryset=models.KeywordTag.objects.only(
+                'id', 'text', 'english_translation', 'category', 'category_translation')),
+            Prefetch('people', queryset=models.People.objects.only('id', 'name', 'english_translation')),
+            Prefetch('dating_tags', queryset=models.DatingTag.objects.only('id', 'text', 'english_translation')),
+        )
+        .defer('iiif_file', 'file', 'reference', 'date_note')
+    )
+
+
+def search_vector():
+    """Weighted tsvector over the Swedish and English documents."""
+    return (
+        SearchVector('text_sv', config='swedish', weight='A')
+        + SearchVector('text_en', config='english', weight='B')
+    )
+
+
+def refresh_image_index(image_ids=None):
+    """Rebuild the search documents and facets of the given images, or of all images.
+
+    Rows are upserted in chunks of CHUNK_SIZE and the document tsvector is
+    computed by the database in one UPDATE per chunk.
+    """
+    if image_ids is None:
+        image_ids = models.Image.objects.order_by('id').values_list('id', flat=True)
+    image_ids = sorted(set(image_ids))
+
+    for start in range(0, len(image_ids), CHUNK_SIZE):
+        chunk = image_ids[start:start + CHUNK_SIZE]
+        images = list(get_document_queryset().filter(id__in=chunk))
+
+        with transaction.atomic():
+            _upsert(models.ImageSearchDocument, [build_document(image) for image in images])
+            _upsert(models.ImageFacets, [build_facets(image) for image in images])
+            models.ImageSearchDocument.objects.filter(image_id__in=chunk).update(search_vector=search_vector())
+
+
+def schedule_refresh(image_ids):
+    """Refresh the given images once the current transaction commits, with
+    one refresh per transaction."""
+    image_ids = list(image_ids)
+    if image_ids:
+        pending.schedule("search-index", refresh_image_index, image_ids)
+
+
+def search_query(value) -> SearchQuery:
+    """Full-text query matching either the Swedish or the English document."""
+    return (
+        SearchQuery(value, config='swedish', search_type='websearch')
+        | SearchQuery(value, config='english', search_type='websearch')
+    )
+
+
+def document_q(value, query=None, prefix="search_document__") -> Q:
+    """Q object matching a free-text value against the image search document.
+
+    Full-text matches are combined with trigram-indexed substring matches,
+    so that partial words (e.g. RAÄ numbers) keep matching as before.
+    """
+    query = query or search_query(value)
+    return (
+        Q(**{f"{prefix}search_vector": query})
+        | Q(**{f"{prefix}text_sv__icontains": value})
+        | Q(**{f"{prefix}text_en__icontains": value})
+    )
+
+
+def field_q(param, value, prefix="search_document__") -> Q:
+    """Q object matching a value against the document column of a search parameter."""
+    return Q(**{f"{prefix}{DOCUMENT_FIELDS[param]}__icontains": value})
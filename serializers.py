@@ -1,5 +1,6 @@
 from diana.abstract.serializers import DynamicDepthSerializer
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
+from rest_framework_gis.fields import GeometryField
 from diana.utils import get_fields, DEFAULT_FIELDS
 from .models import *
 from rest_framework import serializers
@@ -133,6 +134,14 @@ class GeologySerializer(GeoFeatureModelSerializer):
         fields = ['id']+get_fields(Geology, exclude=DEFAULT_FIELDS)
         geo_field = 'coordinates'
 
+    def get_fields(self):
+        # The view can swap in simplified polygons and leave out fields
+        fields = super().get_fields()
+        if self.context.get("simplified"):
+            fields['coordinates'] = GeometryField(source='simplified_coordinates', read_only=True)
+        omitted = self.context.get("omitted_fields", ())
+        return {name: field for name, field in fields.items() if name not in omitted}
+
 
 class CameraLensSerializer(DynamicDepthSerializer):
     class Meta:
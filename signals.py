@@ -1,38 +1,361 @@
-from django.db.models.signals import pre_save, post_save
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed
+from django.db import transaction
 from django.dispatch import receiver
-from django.utils import timezone
-from .models import ResumptionToken, Image
-import requests
+from .models import Image, KeywordTag, People, DatingTag, ImageTypeTag, Institution, RockCarvingObject, Site, Group, Geology, SHFA3D
+from . import autocomplete, pending, search_index, search_cache, iiif_dimensions, regions, suggestions, tag_index, tiles, geology, site_stats
 
 
-@receiver(pre_save, sender=ResumptionToken)
-def delete_old_resumption_tokens(sender, **kwargs):
-    """Delete expired resumption tokens."""
-    ResumptionToken.objects.filter(expiration_date__lte=timezone.now()).delete()
+# Fields whose stored values are kept on save, to tell which of them changed
+TRACKED_FIELDS = {
+    Image: ["site", "type", "institution", "rock_carving_object", "published", "group", "year"],
+    Site: ["parish", "municipality", "province", "coordinates", *site_stats.LABEL_FIELDS],
+    SHFA3D: ["site"],
+}
+
+
+def remember_tracked_fields(sender, instance, update_fields=None, **kwargs):
+    """Keep the stored values of the tracked fields of a saved object."""
+    fields = TRACKED_FIELDS[sender]
+    instance._previous = None
+    if instance.pk is None or (update_fields and not set(update_fields) & set(fields)):
+        return
+    instance._previous = sender.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+for model in TRACKED_FIELDS:
+    pre_save.connect(remember_tracked_fields, sender=model)
+
+
+def previous_value(instance, field):
+    """Stored value (the ID of a relation) of a tracked field before the save."""
+    previous = getattr(instance, "_previous", None)
+    return previous[field] if previous else None
+
+
+def changed_fields(instance, fields, update_fields=None):
+    """Tracked fields of a saved object that changed, or all of them if it is new."""
+    if update_fields:
+        fields = [field for field in fields if field in update_fields]
+    previous = getattr(instance, "_previous", None)
+    if previous is None:
+        return list(fields)
+    opts = instance._meta
+    return [field for field in fields if previous[field] != getattr(instance, opts.get_field(field).attname)]
 
 
 @receiver(post_save, sender=Image)
 def update_image_dimensions(sender, instance, created, **kwargs):
-    # Only fetch if width or height is missing and iiif_file exists
-    if (instance.width is None or instance.height is None) and instance.iiif_file:
-        base_url = "https://img.dh.gu.se/diana/static/"
-        iiif_file_url = getattr(instance.iiif_file, 'url', None)
-        if not iiif_file_url:
+    """Queue images without width or height for the IIIF dimension backfill.
+
+    The info.json is fetched by the backfill_image_dimensions worker, not
+    during the save.
+    """
+    if iiif_dimensions.needs_dimensions(instance):
+        pending.schedule("image-dimensions", iiif_dimensions.enqueue, [instance.id])
+
+
+# Search index maintenance
+@receiver(post_save, sender=Image)
+def update_image_search_document(sender, instance, update_fields=None, **kwargs):
+    """Rebuild the search document of a saved image."""
+    if update_fields and set(update_fields) <= {"width", "height"}:
+        return
+    search_index.schedule_refresh([instance.id])
+
+
+# Image tag relations and the Image field they belong to
+TAG_RELATIONS = {
+    Image.keywords.through: "keywords",
+    Image.people.through: "people",
+    Image.dating_tags.through: "dating_tags",
+}
+
+
+@receiver(m2m_changed, sender=Image.keywords.through)
+@receiver(m2m_changed, sender=Image.people.through)
+@receiver(m2m_changed, sender=Image.dating_tags.through)
+def update_image_tags_search_document(sender, instance, action, reverse, pk_set, **kwargs):
+    """Rebuild the search documents of images whose tags changed."""
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            search_index.schedule_refresh([instance.pk])
+    elif action in ("post_add", "post_remove"):
+        search_index.schedule_refresh(pk_set)
+    elif action == "pre_clear":
+        # The images of a cleared tag are only known before the clear
+        search_index.schedule_refresh(
+            Image.objects.filter(**{TAG_RELATIONS[sender]: instance}).values_list('id', flat=True))
+
+
+# Related objects whose text is copied into the search documents
+DOCUMENT_SOURCES = {
+    KeywordTag: "keywords",
+    People: "people",
+    DatingTag: "dating_tags",
+    ImageTypeTag: "type",
+    Institution: "institution",
+    RockCarvingObject: "rock_carving_object",
+    Site: "site",
+    Group: "group",
+}
+
+
+def update_related_search_documents(sender, instance, created, **kwargs):
+    """Rebuild the search documents of images that refer to a changed tag, site or group."""
+    if created:
+        return
+    search_index.schedule_refresh(
+        Image.objects.filter(**{DOCUMENT_SOURCES[sender]: instance}).values_list('id', flat=True))
+
+
+for model in DOCUMENT_SOURCES:
+    post_save.connect(update_related_search_documents, sender=model)
+
+
+# Fields that place an image or site in a region
+REGION_FIELDS = {
+    Image: ["site"],
+    Site: ["parish", "municipality", "province"],
+}
+
+
+def site_region(site, previous=False):
+    """Region change of a site, by its current or stored relations."""
+    if previous:
+        return ("region", tuple(previous_value(site, field) for field in regions.REGION_FIELDS))
+    return ("region", tuple(getattr(site, f"{field}_id") for field in regions.REGION_FIELDS))
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=Site)
+def update_region_labels(sender, instance, created, update_fields=None, **kwargs):
+    """Rebuild the labels of the regions an image or site is moved from and to."""
+    if not changed_fields(instance, REGION_FIELDS[sender], update_fields):
+        return
+    if sender is Image:
+        regions.schedule_refresh([("site", instance.site_id), ("site", previous_value(instance, "site"))])
+    elif not created:
+        regions.schedule_refresh([site_region(instance), site_region(instance, previous=True)])
+
+
+@receiver(post_delete, sender=Image)
+@receiver(post_delete, sender=Site)
+def update_deleted_region_labels(sender, instance, **kwargs):
+    """Rebuild the labels of the region of a deleted image or site."""
+    if sender is Image:
+        regions.schedule_refresh([("site", instance.site_id)])
+    else:
+        regions.schedule_refresh([site_region(instance)])
+
+
+# Suggestion sources whose terms come from each model, rebuilt when one of
+# its objects is renamed or deleted
+SUGGESTION_SOURCES = {
+    KeywordTag: ["keywords"],
+    People: ["people"],
+    DatingTag: ["dating tag"],
+    ImageTypeTag: ["type"],
+    Institution: ["institution"],
+    RockCarvingObject: ["rock carving"],
+    Site: ["site", "region"],
+}
+
+# Suggestion sources of the Image relations, whose terms are recounted when
+# images are added to or removed from the related objects
+IMAGE_SUGGESTION_SOURCES = {
+    "site": ["site", "region"],
+    "type": ["type"],
+    "institution": ["institution"],
+    "rock_carving_object": ["rock carving"],
+}
+TAG_SUGGESTION_SOURCES = {
+    Image.keywords.through: "keywords",
+    Image.people.through: "people",
+    Image.dating_tags.through: "dating tag",
+}
+
+
+def image_suggestion_changes(instance, fields, previous=False):
+    """(source, related object ID) changes of the given relations of an image."""
+    return [
+        (source, pk)
+        for field in fields
+        for pk in (getattr(instance, f"{field}_id"), previous_value(instance, field) if previous else None)
+        if pk is not None
+        for source in IMAGE_SUGGESTION_SOURCES[field]
+    ]
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def update_image_suggestions(sender, instance, signal, update_fields=None, **kwargs):
+    """Recount the suggestions of the relations of a saved or deleted image.
+
+    Image saves and deletes only change the image counts of the terms of
+    the image, so only those terms are recounted.
+    """
+    if signal is post_save:
+        fields = changed_fields(instance, IMAGE_SUGGESTION_SOURCES, update_fields)
+        changes = image_suggestion_changes(instance, fields, previous=True)
+    else:
+        changes = image_suggestion_changes(instance, IMAGE_SUGGESTION_SOURCES)
+    if changes:
+        suggestions.schedule_refresh(changes)
+
+
+def update_suggestions(sender, signal, **kwargs):
+    """Rebuild the suggestion sources of a renamed or deleted tag, site or other term object."""
+    if signal is post_save and kwargs["created"]:
+        return
+    suggestions.schedule_refresh([(source, None) for source in SUGGESTION_SOURCES[sender]])
+
+
+for model in SUGGESTION_SOURCES:
+    post_save.connect(update_suggestions, sender=model)
+    post_delete.connect(update_suggestions, sender=model)
+
+
+def invalidate_vocabularies(sender, **kwargs):
+    """Make the in-process autocomplete indexes pick up a created, changed or deleted entry."""
+    autocomplete.schedule_bump()
+
+
+for model, _, _ in autocomplete.VOCABULARIES.values():
+    post_save.connect(invalidate_vocabularies, sender=model)
+    post_delete.connect(invalidate_vocabularies, sender=model)
+
+
+@receiver(pre_delete, sender=Image)
+def update_deleted_tag_suggestions(sender, instance, **kwargs):
+    """Rebuild the tag suggestions when images are deleted with their tag relations.
+
+    The tags of each image are not read here, which would cost queries per
+    deleted image; the tag sources are rebuilt once per transaction instead.
+    """
+    suggestions.schedule_refresh([(source, None) for source in TAG_SUGGESTION_SOURCES.values()])
+
+
+@receiver(m2m_changed, sender=Image.keywords.through)
+@receiver(m2m_changed, sender=Image.people.through)
+@receiver(m2m_changed, sender=Image.dating_tags.through)
+def update_tag_suggestions(sender, instance, action, reverse, pk_set, **kwargs):
+    """Recount the tags of images that are tagged or untagged."""
+    if action in ("post_add", "post_remove"):
+        tag_ids = [instance.pk] if reverse else pk_set
+    elif action == "pre_clear":
+        # The tags of a cleared image are only known before the clear
+        tag_ids = [instance.pk] if reverse else getattr(instance, TAG_RELATIONS[sender]).values_list('id', flat=True)
+    else:
+        return
+    suggestions.schedule_refresh([(TAG_SUGGESTION_SOURCES[sender], pk) for pk in tag_ids])
+
+
+def invalidate_search_results(sender, update_fields=None, **kwargs):
+    """Invalidate cached search results when images, tags, sites or groups change."""
+    if sender is Image and update_fields and set(update_fields) <= {"width", "height"}:
+        return
+    search_cache.schedule_bump()
+
+
+for model in [Image, *DOCUMENT_SOURCES]:
+    post_save.connect(invalidate_search_results, sender=model)
+    post_delete.connect(invalidate_search_results, sender=model)
+
+
+@receiver(m2m_changed, sender=Image.keywords.through)
+@receiver(m2m_changed, sender=Image.people.through)
+@receiver(m2m_changed, sender=Image.dating_tags.through)
+def invalidate_tagged_search_results(sender, action, **kwargs):
+    """Invalidate cached search results when images are tagged or untagged."""
+    if action in ("post_add", "post_remove", "post_clear"):
+        search_cache.schedule_bump()
+
+
+def update_tag_index(sender, instance, update_fields=None, **kwargs):
+    """Log images and tags changed for the tag bitmap index."""
+    if not tag_index.enabled():
+        return
+    if sender is Image:
+        if update_fields and not set(update_fields) & tag_index.IMAGE_FIELDS:
             return
-        if not iiif_file_url.startswith("http"):
-            iiif_file_url = base_url + iiif_file_url.lstrip("/")
-        info_url = f"{iiif_file_url}/info.json"
-        try:
-            response = requests.get(info_url, timeout=5)
-            if response.status_code == 200:
-                info = response.json()
-                width = info.get("width")
-                height = info.get("height")
-                # Only update if values are present
-                if width and height:
-                    instance.width = width
-                    instance.height = height
-                    instance.save(update_fields=["width", "height"])
-        except Exception as e:
-            # Optionally log the error
-            print(f"Could not fetch IIIF info for image {instance.id}: {e}")
\ No newline at end of file
+        tag_index.schedule_changes([("image", instance.pk)])
+    else:
+        tag_index.schedule_changes([(tag_index.TAG_PARAMS[sender], instance.pk)])
+
+
+for model in [Image, *tag_index.TAG_PARAMS]:
+    post_save.connect(update_tag_index, sender=model)
+    post_delete.connect(update_tag_index, sender=model)
+
+
+@receiver(m2m_changed, sender=Image.keywords.through)
+@receiver(m2m_changed, sender=Image.people.through)
+@receiver(m2m_changed, sender=Image.dating_tags.through)
+def update_tagged_images_index(sender, instance, action, reverse, pk_set, **kwargs):
+    """Log images tagged or untagged for the tag bitmap index."""
+    if not tag_index.enabled() or action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        changes = [("image", instance.pk)]
+    elif pk_set:
+        changes = [("image", pk) for pk in pk_set]
+    else:
+        # Images removed from a cleared tag are not known any more
+        transaction.on_commit(tag_index.invalidate)
+        return
+    tag_index.schedule_changes(changes)
+
+
+@receiver(post_save, sender=Site)
+@receiver(post_delete, sender=Site)
+def invalidate_site_tiles(sender, instance, update_fields=None, **kwargs):
+    """Invalidate the cached site tiles when a site is moved or deleted.
+
+    Changes of the labels and image counts shown on the tiles are handled
+    by the site statistics refresh.
+    """
+    if kwargs["signal"] is post_delete or changed_fields(instance, ["coordinates"], update_fields):
+        transaction.on_commit(tiles.bump_version)
+
+
+@receiver(post_save, sender=Geology)
+def update_simplified_geology(sender, instance, update_fields=None, **kwargs):
+    """Rebuild the simplified polygons of a geology when its polygon changes."""
+    if update_fields and "coordinates" not in update_fields:
+        return
+    geology.schedule_refresh([instance.pk])
+
+
+# Fields of the images and 3D models the site statistics are computed from
+STATS_FIELDS = {
+    Image: site_stats.IMAGE_FIELDS,
+    SHFA3D: ["site"],
+}
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=SHFA3D)
+def update_site_stats(sender, instance, update_fields=None, **kwargs):
+    """Rebuild the statistics of the sites of a changed image or 3D model."""
+    if changed_fields(instance, STATS_FIELDS[sender], update_fields):
+        site_stats.schedule_refresh([instance.site_id, previous_value(instance, "site")])
+
+
+@receiver(post_delete, sender=Image)
+@receiver(post_delete, sender=SHFA3D)
+def update_deleted_site_stats(sender, instance, **kwargs):
+    """Rebuild the statistics of the site of a deleted image or 3D model."""
+    site_stats.schedule_refresh([instance.site_id])
+
+
+@receiver(post_save, sender=Site)
+def update_site_label(sender, instance, update_fields=None, **kwargs):
+    """Rebuild the statistics row of a saved site, which carries its label."""
+    if changed_fields(instance, site_stats.LABEL_FIELDS, update_fields):
+        site_stats.schedule_refresh([instance.pk])
+
+
+@receiver(pre_delete, sender=Group)
+def update_grouped_site_stats(sender, instance, **kwargs):
+    """Rebuild the statistics of the sites whose images lose their group."""
+    site_stats.schedule_refresh(instance.images_set.values_list('site_id', flat=True).distinct())
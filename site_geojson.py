@@ -0,0 +1,58 @@
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.fields import DateTimeField
+import datetime
+import json
+
+# Default number of decimals of the coordinates (about 10 cm)
+PRECISION = 6
+
+# Features encoded per streamed chunk
+CHUNK_SIZE = 1000
+
+
+def feature_properties(serializer_class, lookups=None):
+    """(property, lookup) pairs of the properties of a GeoFeatureModelSerializer.
+
+    Lookups default to the property name; serializers that render related
+    names (e.g. parish.name) pass them, e.g. {"parish": "parish__name"}.
+    """
+    meta = serializer_class.Meta
+    lookups = lookups or {}
+    return [(name, lookups.get(name, name)) for name in meta.fields if name not in ('id', meta.geo_field)]
+
+
+def stream_feature_collection(queryset, properties, precision=PRECISION, geo_field='coordinates'):
+    """GeoJSON FeatureCollection of a queryset, as chunks of text.
+
+    Only the property columns are selected with values_list, and the
+    geometry is encoded by PostGIS (ST_AsGeoJSON) and copied as is, so no
+    model instances or GEOS objects are created. The output has the same
+    shape as GeoFeatureModelSerializer, with datetimes formatted by DRF.
+    """
+    names = [name for name, _ in properties]
+    rows = (
+        queryset
+        .annotate(geojson=AsGeoJSON(geo_field, precision=precision))
+        .values_list('id', 'geojson', *[lookup for _, lookup in properties])
+    )
+    encode = DjangoJSONEncoder(ensure_ascii=False).encode
+    to_datetime = DateTimeField().to_representation
+
+    def represent(value):
+        # Local time zone and microseconds, as in the serializers
+        return to_datetime(value) if isinstance(value, datetime.datetime) else value
+
+    yield '{"type": "FeatureCollection", "features": ['
+    chunk = []
+    separator = ""
+    for pk, geometry, *values in rows.iterator(chunk_size=CHUNK_SIZE):
+        chunk.append(
+            f'{separator}{{"type": "Feature", "id": {json.dumps(pk)}, "geometry": {geometry or "null"}, '
+            f'"properties": {encode(dict(zip(names, map(represent, values))))}}}'
+        )
+        separator = ", "
+        if len(chunk) == CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    yield "".join(chunk) + "]}"
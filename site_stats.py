@@ -0,0 +1,90 @@
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from . import models, pending, tiles
+
+# Site fields read to build the display label
+LABEL_FIELDS = ['raa_id', 'lamning_id', 'askeladden_id', 'lokalitet_id', 'placename']
+
+# Image fields the statistics are computed from
+IMAGE_FIELDS = ['site', 'published', 'group', 'type', 'year']
+
+
+def tile_facts(label, image_count, total_image_count):
+    """The statistics shown on the map tiles: label, published images and
+    whether the site is on the map at all."""
+    return label, image_count, total_image_count > 0
+
+
+def refresh_site_stats(site_ids=None) -> int:
+    """Rebuild the statistics of the given sites, or of all sites.
+
+    Image and 3D model facts are read with one grouped query each, and the
+    rows of the sites are replaced in a single transaction. Returns the
+    number of rows. The map tiles are only invalidated when the statistics
+    they show change.
+    """
+    sites = models.Site.objects.only('id', *LABEL_FIELDS)
+    images = models.Image.objects.filter(site__isnull=False)
+    models_3d = models.SHFA3D.objects.filter(site__isnull=False)
+    if site_ids is not None:
+        site_ids = {pk for pk in site_ids if pk is not None}
+        sites = sites.filter(id__in=site_ids)
+        images = images.filter(site_id__in=site_ids)
+        models_3d = models_3d.filter(site_id__in=site_ids)
+
+    published = Q(published=True)
+    image_rows = (
+        images
+        .values('site')
+        .annotate(
+            published_count=Count('id', filter=published),
+            total_count=Count('id'),
+            group_count=Count('id', filter=Q(group__isnull=False)),
+            types=ArrayAgg('type', filter=published & Q(type__isnull=False), distinct=True),
+            min_year=Min('year', filter=published),
+            max_year=Max('year', filter=published),
+        )
+        .order_by()
+    )
+    image_facts = {row['site']: row for row in image_rows}
+    model_counts = dict(models_3d.values('site').annotate(count=Count('id')).order_by().values_list('site', 'count'))
+
+    objs = []
+    for site in sites:
+        facts = image_facts.get(site.id, {})
+        objs.append(models.SiteStats(
+            site_id=site.id,
+            label=str(site),
+            image_count=facts.get('published_count', 0),
+            total_image_count=facts.get('total_count', 0),
+            group_image_count=facts.get('group_count', 0),
+            visualization_group_count=model_counts.get(site.id, 0),
+            type_ids=sorted(facts.get('types') or []),
+            min_year=facts.get('min_year'),
+            max_year=facts.get('max_year'),
+        ))
+
+    with transaction.atomic():
+        stale = models.SiteStats.objects.all()
+        if site_ids is not None:
+            stale = stale.filter(site_id__in=site_ids)
+        previous = {
+            site_id: tile_facts(*facts)
+            for site_id, *facts in stale.values_list('site_id', 'label', 'image_count', 'total_image_count')
+        }
+        stale.delete()
+        models.SiteStats.objects.bulk_create(objs, batch_size=1000)
+
+    current = {obj.site_id: tile_facts(obj.label, obj.image_count, obj.total_image_count) for obj in objs}
+    if current != previous:
+        tiles.bump_version()
+    return len(objs)
+
+
+def schedule_refresh(site_ids):
+    """Rebuild the statistics of sites once the current transaction commits,
+    with one rebuild per transaction."""
+    site_ids = {pk for pk in site_ids if pk is not None}
+    if site_ids:
+        pending.schedule("site-stats", refresh_site_stats, site_ids)
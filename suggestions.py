@@ -0,0 +1,150 @@
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Value, When
+from . import models, autocomplete, pending
+
+# Image fields whose values are suggested, per source
+SOURCES = {
+    "keywords": ["keywords__text", "keywords__english_translation",
+                 "keywords__category", "keywords__category_translation"],
+    "people": ["people__name", "people__english_translation"],
+    "site": ["site__placename", "site__raa_id"],
+    "type": ["type__text", "type__english_translation"],
+    "institution": ["institution__name"],
+    "dating tag": ["dating_tags__text", "dating_tags__english_translation"],
+    "rock carving": ["rock_carving_object__name"],
+    "region": ["site__parish__name", "site__municipality__name", "site__province__name"],
+}
+
+# Image relation of each source, whose related objects carry its terms
+RELATIONS = {
+    "keywords": "keywords",
+    "people": "people",
+    "site": "site",
+    "type": "type",
+    "institution": "institution",
+    "dating tag": "dating_tags",
+    "rock carving": "rock_carving_object",
+    "region": "site",
+}
+
+# Maximum number of suggestions returned
+LIMIT = 20
+
+
+def normalize(term) -> str:
+    return str(term).strip().lower()
+
+
+def build_suggestions(source, values=None):
+    """Suggestions of a source with the number of images of each term.
+
+    One grouped query per field; a term found in several fields of the same
+    source keeps its highest count. Given values, only the terms with
+    those values are counted.
+    """
+    counts = {}
+    for field in SOURCES[source]:
+        images = models.Image.objects.filter(**{f"{field}__isnull": False})
+        if values is not None:
+            images = images.filter(**{f"{field}__in": values})
+        rows = (
+            images
+            .values_list(field)
+            .annotate(images=Count('id', distinct=True))
+            .order_by()
+        )
+        for term, images in rows:
+            term = str(term).strip()
+            if term:
+                counts[term] = max(counts.get(term, 0), images)
+
+    return [
+        models.SearchSuggestion(term=term, normalized=normalize(term), source=source, image_count=images)
+        for term, images in counts.items()
+    ]
+
+
+def refresh_suggestions(sources=None):
+    """Rebuild the suggestions of the given sources, or of all sources."""
+    sources = list(sources or SOURCES)
+    objs = [obj for source in sources for obj in build_suggestions(source)]
+
+    with transaction.atomic():
+        models.SearchSuggestion.objects.filter(source__in=sources).delete()
+        models.SearchSuggestion.objects.bulk_create(objs, batch_size=1000)
+
+    autocomplete.bump_version()
+    return len(objs)
+
+
+def related_values(source, related_ids):
+    """Values of the fields of a source on the related objects with the given IDs."""
+    relation = RELATIONS[source]
+    related = models.Image._meta.get_field(relation).related_model
+    paths = [field[len(relation) + 2:] for field in SOURCES[source]]
+    return {
+        value
+        for row in related.objects.filter(id__in=related_ids).values_list(*paths)
+        for value in row if value is not None
+    }
+
+
+def refresh_terms(source, related_ids) -> int:
+    """Recount the suggestions of a source that come from the related
+    objects with the given IDs, e.g. the keywords of a retagged image.
+
+    Terms left without images are removed.
+    """
+    values = related_values(source, related_ids)
+    terms = {str(value).strip() for value in values}
+    objs = build_suggestions(source, values) if values else []
+
+    with transaction.atomic():
+        models.SearchSuggestion.objects.filter(source=source, term__in=terms).delete()
+        models.SearchSuggestion.objects.bulk_create(objs, batch_size=1000)
+    return len(objs)
+
+
+def refresh_changed_suggestions(changes):
+    """Update the suggestions touched by changes, given as (source, related
+    object ID) pairs; a related object ID of None rebuilds the whole source."""
+    sources = {source for source, pk in changes if pk is None}
+    if sources:
+        refresh_suggestions(sources)
+
+    related_ids = {}
+    for source, pk in changes:
+        if source not in sources:
+            related_ids.setdefault(source, set()).add(pk)
+    for source, ids in related_ids.items():
+        refresh_terms(source, ids)
+    if related_ids:
+        autocomplete.bump_version()
+
+
+def schedule_refresh(changes):
+    """Update the suggestions touched by changes once the current transaction
+    commits, with one update per transaction."""
+    pending.schedule("suggestions", refresh_changed_suggestions, changes)
+
+
+def suggest(q, limit=LIMIT):
+    """Suggestions containing q, ranked by match quality and popularity.
+
+    Exact matches come first, then prefix matches (both served by the
+    prefix index), then other substring matches (trigram index); within
+    each group terms found on more images rank higher.
+    """
+    q = normalize(q)
+    return list(
+        models.SearchSuggestion.objects
+        .filter(normalized__contains=q)
+        .annotate(match=Case(
+            When(normalized=q, then=Value(2)),
+            When(normalized__startswith=q, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+        .order_by('-match', '-image_count', 'term', 'source')
+        .values('term', 'source')[:limit]
+    )
@@ -0,0 +1,195 @@
+from django.conf import settings
+from django.core.cache import cache
+from . import models, pending
+import threading
+
+try:
+    from pyroaring import BitMap as Bitmap
+except ImportError:
+    # Sets support the same operations, using more memory
+    Bitmap = set
+
+# Shared counter bumped on every change; each process applies the changes
+# logged under the versions it has not seen yet
+VERSION_KEY = "shfa:tag-index:version"
+CHANGES_KEY = "shfa:tag-index:changes"
+CHANGES_TIMEOUT = 60 * 60 * 24
+
+# Processes further behind than this, or with more changed images to
+# reload, rebuild the whole index instead
+MAX_PENDING = 1000
+
+# Search parameters answered from the index: tag model, image field and the
+# tag fields its values are matched against
+DIMENSIONS = {
+    "keyword": (models.KeywordTag, "keywords",
+                ["text", "english_translation", "category", "category_translation"]),
+    "author_name": (models.People, "people", ["name", "english_translation"]),
+    "dating_tag": (models.DatingTag, "dating_tags", ["text", "english_translation"]),
+    "image_type": (models.ImageTypeTag, "type", ["text", "english_translation"]),
+    "institution_name": (models.Institution, "institution", ["name"]),
+    "site_name": (models.Site, "site",
+                  ["raa_id", "lamning_id", "askeladden_id", "lokalitet_id", "placename", "ksamsok_id"]),
+}
+
+# Search parameter of each tag model
+TAG_PARAMS = {model: param for param, (model, _, _) in DIMENSIONS.items()}
+
+# Image fields stored in the index
+IMAGE_FIELDS = {"published", "type", "institution", "site"}
+
+
+def enabled() -> bool:
+    """Whether tag filters are answered from the in-process bitmap index."""
+    return getattr(settings, "SHFA_TAG_BITMAP_INDEX", False)
+
+
+def record_changes(changes):
+    """Log changed images and tags, given as ("image", id) or (param, tag id),
+    for every process to apply on next use."""
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        version = 1
+        cache.set(VERSION_KEY, version, None)
+    cache.set(f"{CHANGES_KEY}:{version}", list(changes), CHANGES_TIMEOUT)
+
+
+def schedule_changes(changes):
+    """Log changes once the current transaction commits, in one entry per transaction."""
+    pending.schedule("tag-index", record_changes, changes)
+
+
+def invalidate():
+    """Make every process rebuild its index on next use."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def _load_texts(param, ids=None):
+    """Lowercased searchable text of the tags of a dimension, by tag ID."""
+    model, _, fields = DIMENSIONS[param]
+    rows = model.objects.all()
+    if ids is not None:
+        rows = rows.filter(id__in=ids)
+    return {
+        row[0]: "\n".join(str(value).lower() for value in row[1:] if value)
+        for row in rows.values_list('id', *fields)
+    }
+
+
+def _load_memberships(param, image_ids=None):
+    """(tag ID, image ID) pairs of the published images of a dimension."""
+    _, field, _ = DIMENSIONS[param]
+    rows = models.Image.objects.filter(published=True, **{f"{field}__isnull": False})
+    if image_ids is not None:
+        rows = rows.filter(id__in=image_ids)
+    return rows.values_list(field, 'id').order_by()
+
+
+class TagIndex:
+    """Inverted index from each tag to the bitmap of its published images.
+
+    Built at first use and kept up to date from the change log written by
+    the signals. Values are matched against the tag texts exactly, or else
+    like icontains, and the bitmaps of the matching tags are combined with
+    unions and intersections instead of one join per value.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._texts = None
+        self._bitmaps = None
+
+    def _build(self):
+        texts, bitmaps = {}, {}
+        for param in DIMENSIONS:
+            texts[param] = _load_texts(param)
+            bitmaps[param] = {}
+            for tag_id, image_id in _load_memberships(param):
+                bitmaps[param].setdefault(tag_id, Bitmap()).add(image_id)
+        self._texts, self._bitmaps = texts, bitmaps
+
+    def _apply(self, changes):
+        for param in DIMENSIONS:
+            tag_ids = {pk for kind, pk in changes if kind == param}
+            if not tag_ids:
+                continue
+            texts = _load_texts(param, tag_ids)
+            for pk in tag_ids - texts.keys():
+                self._texts[param].pop(pk, None)
+                self._bitmaps[param].pop(pk, None)
+            self._texts[param].update(texts)
+
+        image_ids = {pk for kind, pk in changes if kind == "image"}
+        if not image_ids:
+            return
+        removed = Bitmap(image_ids)
+        for param, bitmaps in self._bitmaps.items():
+            for bitmap in bitmaps.values():
+                bitmap -= removed
+            for tag_id, image_id in _load_memberships(param, image_ids):
+                bitmaps.setdefault(tag_id, Bitmap()).add(image_id)
+
+    def _current(self):
+        version = cache.get(VERSION_KEY, 0)
+        if self._bitmaps is not None and version == self._version:
+            return
+
+        changes = None
+        if self._bitmaps is not None and self._version < version <= self._version + MAX_PENDING:
+            keys = [f"{CHANGES_KEY}:{n}" for n in range(self._version + 1, version + 1)]
+            entries = cache.get_many(keys)
+            if len(entries) == len(keys):
+                changes = [tuple(change) for key in keys for change in entries[key]]
+
+        if changes is None or sum(kind == "image" for kind, _ in changes) > MAX_PENDING:
+            self._build()
+        else:
+            self._apply(changes)
+        self._version = version
+
+    def _match(self, param, value):
+        # Tags named exactly by the value take precedence over substring
+        # matches, like the ID resolution of the SQL search
+        value = value.lower()
+        texts = self._texts[param]
+        tag_ids = [tag_id for tag_id, text in texts.items() if value in text.split("\n")]
+        if not tag_ids:
+            tag_ids = [tag_id for tag_id, text in texts.items() if value in text]
+
+        bitmaps = self._bitmaps[param]
+        result = Bitmap()
+        for tag_id in tag_ids:
+            if tag_id in bitmaps:
+                result |= bitmaps[tag_id]
+        return result
+
+    def select(self, filters):
+        """Bitmap of the published images matching every filter.
+
+        Filters are given as {param: (values, operator)}; the images of the
+        values of a parameter are intersected for "AND" and united otherwise.
+        """
+        with self._lock:
+            self._current()
+            result = None
+            for param, (values, operator) in filters.items():
+                selected = None
+                for value in values:
+                    matched = self._match(param, value)
+                    if selected is None:
+                        selected = matched
+                    elif operator == "AND":
+                        selected &= matched
+                    else:
+                        selected |= matched
+                if selected is not None:
+                    result = selected if result is None else result & selected
+            return result
+
+
+index = TagIndex()
@@ -19,12 +19,9 @@
 
 from django.conf import settings
 from django.template import Library
-from django.utils import timezone
 from django.utils.safestring import mark_safe
-from ..models import MetadataFormat, ResumptionToken
 
 from html import escape
-from os import urandom
 register = Library()
 
 REPOSITORY_NAME = "SHFA"
@@ -78,40 +75,24 @@ def get_image_tags(image):
     return ", ".join(tags)
 
 @register.simple_tag
-def resumption_token(
-    paginator,
-    page,
-    metadata_prefix=None,
-    from_timestamp=None,
-    until_timestamp=None,
-):
-    """Get resumption token."""
-    if paginator.num_pages > 0 and page.has_next():
-        expiration_date = timezone.now() + timezone.timedelta(days=1)
-        token = "".join("%02x" % i for i in urandom(16))
-
-        metadata_format = None
-        if metadata_prefix:
-            metadata_format = MetadataFormat.objects.get(prefix=metadata_prefix)
-
-        ResumptionToken.objects.create(
-            token=token,
-            expiration_date=expiration_date,
-            complete_list_size=paginator.count,
-            cursor=page.end_index(),
-            metadata_prefix=metadata_format,
-            from_timestamp=from_timestamp,
-            until_timestamp=until_timestamp,
-        )
-
-        return mark_safe(
-            "<resumptionToken expirationDate="
-            f"\"{expiration_date.strftime('%Y-%m-%dT%H:%M:%SZ')}\" "
-            f'completeListSize="{paginator.count}" cursor="{page.end_index()}">'
-            f"{token}</resumptionToken>"
-        )
-    else:
+def resumption_token(token):
+    """Get resumption token element.
+
+    The token is built by oai_cat; an empty token with the list size and
+    cursor marks the last page of a split list.
+    """
+    if not token:
         return ""
+
+    expiration_date = ""
+    if token["expiration_date"]:
+        expiration_date = f' expirationDate="{token["expiration_date"].strftime("%Y-%m-%dT%H:%M:%SZ")}"'
+
+    return mark_safe(
+        f"<resumptionToken{expiration_date} "
+        f'completeListSize="{token["complete_list_size"]}" cursor="{token["cursor"]}">'
+        f"{escape(token['value'])}</resumptionToken>"
+    )
     
 
 @register.simple_tag
@@ -0,0 +1,164 @@
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from . import models, search_cache
+import math
+
+# Counter bumped whenever sites or their images change; it is part of every
+# tile cache key, so a bump invalidates all cached tiles at once
+VERSION_KEY = "shfa:site-tiles:version"
+
+CONTENT_TYPE = "application/vnd.mapbox-vector-tile"
+LAYER_NAME = "sites"
+MAX_ZOOM = 22
+MAX_LATITUDE = 85.0511
+
+# Clusters per tile width; with 256 pixel tiles a cluster cell is 64 pixels
+CLUSTER_CELLS = 4
+
+# Tile coordinate space, and the margin around a tile whose points are
+# still included so that symbols on tile edges are not cut off
+EXTENT = 4096
+BUFFER = 64
+
+
+def bump_version():
+    """Invalidate every cached tile."""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, None)
+
+
+def is_valid_tile(z, x, y) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_bounds(z, x, y, buffer=BUFFER):
+    """Longitude/latitude bounds of a web mercator tile, with its buffer."""
+    n = 2 ** z
+    margin = buffer / EXTENT
+
+    def longitude(tx):
+        return tx / n * 360 - 180
+
+    def latitude(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    west, east = longitude(x - margin), longitude(x + 1 + margin)
+    south, north = latitude(min(y + 1 + margin, n)), latitude(max(y - margin, 0))
+    return max(west, -180), south, min(east, 180), north
+
+
+def tile_of(z, longitude, latitude):
+    """Web mercator tile containing a point."""
+    n = 2 ** z
+    latitude = max(min(latitude, MAX_LATITUDE), -MAX_LATITUDE)
+    x = int((longitude + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def map_sites(bounds):
+    """Sites with images within bounds, with their ID, label and number of
+    published images from the site statistics."""
+    return (
+        models.Site.objects
+        .filter(stats__total_image_count__gt=0, coordinates__bboverlaps=Polygon.from_bbox(bounds))
+        .values('id', 'coordinates', label=F('stats__label'), image_count=F('stats__image_count'))
+    )
+
+
+def render_tile(z, x, y) -> bytes:
+    """Mapbox Vector Tile of the sites of a tile, encoded by PostGIS."""
+    sql, params = map_sites(tile_bounds(z, x, y)).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT ST_AsMVT(tile, %s, %s, 'geom')
+            FROM (
+                SELECT site.id, site.label, site.image_count,
+                       ST_AsMVTGeom(ST_Transform(site.coordinates, 3857), ST_TileEnvelope(%s, %s, %s), %s, %s, true) AS geom
+                FROM ({sql}) AS site
+            ) AS tile
+            WHERE tile.geom IS NOT NULL
+            """,
+            [LAYER_NAME, EXTENT, z, x, y, EXTENT, BUFFER, *params],
+        )
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] else b""
+
+
+def site_tile(z, x, y) -> bytes:
+    """Tile of the sites, cached until sites or their images change."""
+    version = cache.get(VERSION_KEY, 0)
+    key = f"shfa:site-tiles:{version}:{z}:{x}:{y}"
+    tile = cache.get(key)
+    if tile is None:
+        tile = render_tile(z, x, y)
+        cache.set(key, tile, getattr(settings, 'SHFA_TILE_CACHE_TIMEOUT', 60 * 60 * 24))
+    return tile
+
+
+def render_clusters(z, bounds):
+    """Sites within bounds grouped on a grid of CLUSTER_CELLS cells per
+    tile width at zoom z, with the centroid, number of sites and number of
+    published images of each cluster."""
+    size = 360 / 2 ** z / CLUSTER_CELLS
+    sql, params = map_sites(bounds).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT cluster.count, cluster.image_count, cluster.site,
+                   ST_X(cluster.centroid), ST_Y(cluster.centroid)
+            FROM (
+                SELECT count(*) AS count, sum(site.image_count) AS image_count, min(site.id) AS site,
+                       ST_Centroid(ST_Collect(site.coordinates)) AS centroid
+                FROM ({sql}) AS site
+                GROUP BY ST_SnapToGrid(site.coordinates, %s)
+            ) AS cluster
+            ORDER BY cluster.count DESC
+            """,
+            [*params, size],
+        )
+        rows = cursor.fetchall()
+
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [x, y]},
+                # The site is only given for clusters of a single site
+                "properties": {"count": count, "image_count": image_count,
+                               "site": site if count == 1 else None},
+            }
+            for count, image_count, site, x, y in rows
+        ],
+    }
+
+
+def site_clusters(z, bbox=None):
+    """Clusters of the sites within a bounding box, or within the extent
+    of all sites.
+
+    The box is widened to whole tiles at zoom z, and the clusters are
+    cached per zoom and tile range until sites or their images change.
+    """
+    bbox = bbox or search_cache.site_extent()
+    if not bbox:
+        return {"type": "FeatureCollection", "features": []}
+
+    x0, y0 = tile_of(z, bbox[0], bbox[3])
+    x1, y1 = tile_of(z, bbox[2], bbox[1])
+    version = cache.get(VERSION_KEY, 0)
+    key = f"shfa:site-clusters:{version}:{z}:{x0}:{y0}:{x1}:{y1}"
+    clusters = cache.get(key)
+    if clusters is None:
+        west, _, _, north = tile_bounds(z, x0, y0, buffer=0)
+        _, south, east, _ = tile_bounds(z, x1, y1, buffer=0)
+        clusters = render_clusters(z, (west, south, east, north))
+        cache.set(key, clusters, getattr(settings, 'SHFA_TILE_CACHE_TIMEOUT', 60 * 60 * 24))
+    return clusters
@@ -76,6 +76,9 @@ path(rf'{endpoint}/iiif/', include('apps.shfa.manifest.urls')),
 router.register(r'shfa/contact', views.ContactFormViewSet, basename='contact')
 
 urlpatterns = [
+    # Vector tiles of the site map layer
+    path(rf'{endpoint}/geojson/site/tiles/<int:z>/<int:x>/<int:y>.mvt', views.site_tile, name="site-tiles"),
+
     path('', include(router.urls)),
     # add oai-pmh end points
     path(rf'{endpoint}/OAICat/', views.oai, name="oai"),
@@ -86,9 +89,10 @@ urlpatterns = [
     # Automatically generated views
     *utils.get_model_urls('shfa', endpoint,
                           exclude=['image', 'site', 'compilation', 'image_keywords',
-                                   'image_carving_tags', 'image_dating_tags', 'compilation_images', 'geology', 'shfa3dmesh', 'shfa3d']),
+                                   'image_carving_tags', 'image_dating_tags', 'compilation_images', 'geology', 'shfa3dmesh', 'shfa3d',
+                                   'imagesearchdocument', 'imagefacets', 'imagedimensiontask', 'regionlabel', 'searchsuggestion', 'simplifiedgeology', 'sitestats']),
 
     *utils.get_model_urls('shfa', f'{endpoint}',
-                          exclude=['image', 'site', 'geology', 'shfa3dmesh', 'shfa3d']),
+                          exclude=['image', 'site', 'geology', 'shfa3dmesh', 'shfa3d', 'imagesearchdocument', 'imagefacets', 'imagedimensiontask', 'regionlabel', 'searchsuggestion', 'simplifiedgeology', 'sitestats']),
     *documentation
 ]
@@ -1,12 +1,12 @@
-from . import models, serializers
-from django.db.models import Q, Count, Prefetch
+from . import models, serializers, search_index, search_cache, facets, suggestions, autocomplete, tag_index, tiles, geology, site_geojson
+from django.db.models import Q, F, Count, Prefetch, Value, Exists, OuterRef, Subquery
+from django.contrib.postgres.search import SearchRank
 from diana.abstract.views import DynamicDepthViewSet, GeoViewSet
 from diana.abstract.models import get_fields, DEFAULT_FIELDS
 from django.views.decorators.csrf import csrf_exempt
+from django.http import HttpResponse, Http404, StreamingHttpResponse
 from .oai_cat import *
-from django.contrib.gis.geos import Polygon
-from django.contrib.gis.gdal.envelope import Envelope
-from django.contrib.gis.db.models import Extent
+from django.contrib.gis.db.models import Extent, PolygonField
 from functools import reduce
 from rest_framework import viewsets, status
 from rest_framework.viewsets import ViewSet
@@ -18,10 +18,16 @@ from django.conf import settings
 from rest_framework import status
 from django.contrib.gis.db.models.aggregates import Extent
 import gc
-from django.db import connection
+import json
+from django.db import connections
+from django.core.cache import cache
+from django.core.paginator import Paginator as DjangoPaginator
 from django.utils.functional import cached_property
-from rest_framework.pagination import PageNumberPagination
-from itertools import chain
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.exceptions import APIException, NotFound, ParseError
+from rest_framework.utils.urls import replace_query_param
+from django.db.models.functions import Coalesce
+import base64
 
 class SiteViewSet(DynamicDepthViewSet):
     serializer_class = serializers.SiteSerializer
@@ -33,12 +39,39 @@ class SiteViewSet(DynamicDepthViewSet):
     bbox_filter_field = 'coordinates'
     bbox_filter_include_overlapping = True
 
-class SiteGeoViewSet(GeoViewSet):
+class CompactGeoJSONMixin:
+    """Serve ?compact=true list requests as a streamed FeatureCollection
+    encoded from the selected columns, instead of the serializer.
+
+    ?coordinate_precision= sets the number of decimals of the coordinates.
+    """
+    # Lookups of properties rendered from related objects
+    compact_lookups = {}
+
+    def list(self, request, *args, **kwargs):
+        if request.GET.get("compact", "").lower() not in ("1", "true"):
+            return super().list(request, *args, **kwargs)
+
+        try:
+            precision = int(request.GET.get("coordinate_precision", site_geojson.PRECISION))
+        except ValueError:
+            raise ParseError("coordinate_precision must be a number of decimals")
+        if not 0 <= precision <= 15:
+            raise ParseError("coordinate_precision must be between 0 and 15")
+
+        queryset = self.filter_queryset(self.get_queryset())
+        properties = site_geojson.feature_properties(self.get_serializer_class(), self.compact_lookups)
+        return StreamingHttpResponse(
+            site_geojson.stream_feature_collection(queryset, properties, precision),
+            content_type="application/json")
+
+
+class SiteGeoViewSet(CompactGeoJSONMixin, GeoViewSet):
 
     serializer_class = serializers.SiteGeoSerializer
-    images = models.Image.objects.all()
+    # Sites with images, from the precomputed site statistics
     queryset = models.Site.objects.filter(
-        id__in=list(images.values_list('site', flat=True))
+        stats__total_image_count__gt=0
     ).order_by('raa_id', 'lamning_id', 'placename')
 
     filterset_fields = get_fields(
@@ -47,12 +80,33 @@ class SiteGeoViewSet(GeoViewSet):
     bbox_filter_field = 'coordinates'
     bbox_filter_include_overlapping = True
 
+    def list(self, request, *args, **kwargs):
+        # ?cluster=<zoom> returns the sites grouped in PostGIS for that zoom level
+        zoom = request.GET.get("cluster")
+        if zoom is None:
+            return super().list(request, *args, **kwargs)
+
+        try:
+            zoom = int(zoom)
+            bbox = search_cache.round_bbox(request.GET["in_bbox"]) if request.GET.get("in_bbox") else None
+        except ValueError:
+            raise ParseError("cluster must be a zoom level and in_bbox four coordinates")
+        if not 0 <= zoom <= tiles.MAX_ZOOM:
+            raise ParseError(f"cluster must be a zoom level between 0 and {tiles.MAX_ZOOM}")
+
+        return Response(tiles.site_clusters(zoom, bbox))
+
+def site_tile(request, z, x, y):
+    """Mapbox Vector Tile of the sites with images, with their label and image count."""
+    if not tiles.is_valid_tile(z, x, y):
+        raise Http404("Invalid tile")
+    return HttpResponse(tiles.site_tile(z, x, y), content_type=tiles.CONTENT_TYPE)
+
 # Add 3D views
 class SHFA3DViewSet(DynamicDepthViewSet):
     serializer_class = serializers.SHFA3DSerializer
-    tree_d_data_group = models.Group.objects.all()
-    queryset = models.SHFA3D.objects.filter(
-        group_id__in=list(tree_d_data_group.values_list('id', flat=True)))
+    # Every non-null group_id refers to an existing Group (foreign key)
+    queryset = models.SHFA3D.objects.filter(group__isnull=False)
     filterset_fields = get_fields(models.SHFA3D, exclude=DEFAULT_FIELDS)
 
 class VisualizationGroupViewset(DynamicDepthViewSet):
@@ -88,6 +142,51 @@ class GeologyViewSet(GeoViewSet):
     filterset_fields = get_fields(
         models.Geology, exclude=DEFAULT_FIELDS + ['coordinates', ])
 
+    def get_resolution(self):
+        """Resolution from ?resolution=, or derived from ?in_bbox=; 0 is the full geometry."""
+        params = self.request.GET
+        try:
+            if params.get("resolution"):
+                resolution = int(params["resolution"])
+            elif params.get("in_bbox"):
+                bbox = search_cache.round_bbox(params["in_bbox"])
+                resolution = geology.resolution_for_bbox(bbox) if bbox else 0
+            else:
+                resolution = 0
+        except ValueError:
+            raise ParseError("resolution must be a number and in_bbox four coordinates")
+        if resolution and resolution not in geology.TOLERANCES:
+            raise ParseError(f"resolution must be one of 0, {', '.join(map(str, geology.TOLERANCES))}")
+        return resolution
+
+    def get_omitted_fields(self):
+        """Heavy fields not listed in ?fields= (all fields are returned without it)."""
+        requested = self.request.GET.get("fields")
+        if not requested:
+            return set()
+        return geology.HEAVY_FIELDS - {field.strip() for field in requested.split(",")}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        omitted = self.get_omitted_fields()
+        if omitted:
+            queryset = queryset.defer(*omitted)
+
+        resolution = self.get_resolution()
+        if resolution:
+            # Falls back to the full polygon until it has been simplified
+            simplified = models.SimplifiedGeology.objects.filter(
+                geology=OuterRef('pk'), resolution=resolution).values('coordinates')
+            queryset = queryset.defer('coordinates').annotate(simplified_coordinates=Coalesce(
+                Subquery(simplified, output_field=PolygonField()), F('coordinates'), output_field=PolygonField()))
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["simplified"] = bool(self.get_resolution())
+        context["omitted_fields"] = self.get_omitted_fields()
+        return context
+
 class SHFA3DMeshViewset(DynamicDepthViewSet):
     serializer_class = serializers.SHFA3DMeshSerializer
     queryset = models.SHFA3DMesh.objects.all()
@@ -101,12 +200,11 @@ class CameraSpecificationViewSet(DynamicDepthViewSet):
         models.CameraMeta, exclude=DEFAULT_FIELDS)
 
 # Search views
-class SiteSearchViewSet(GeoViewSet):
+class SiteSearchViewSet(CompactGeoJSONMixin, GeoViewSet):
     serializer_class = serializers.SiteGeoSerializer
 
     def get_queryset(self):
         q = self.request.GET["site_name"]
-        images = models.Image.objects.all()
         queryset = models.Site.objects.filter(Q
                                               (Q(raa_id__icontains=q)
                                                | Q(lamning_id__icontains=q)
@@ -116,7 +214,7 @@ class SiteSearchViewSet(GeoViewSet):
                                                | Q(lokalitet_id__icontains=q)
                                                )
                                               & Q
-                                              (id__in=list(images.values_list('site', flat=True)))
+                                              (Exists(models.Image.objects.filter(site=OuterRef('pk'))))
                                               ).order_by('raa_id', 'lamning_id', 'placename', 'ksamsok_id', 'askeladden_id', 'lokalitet_id')
 
         return queryset
@@ -156,19 +254,12 @@ class SearchBoundingBoxImageViewSet(DynamicDepthViewSet):
     serializer_class = serializers.TIFFImageSerializer
 
     def get_queryset(self):
-        box = self.request.GET["in_bbox"]
-        box = box.strip().split(',')
-        bbox_coords = [
-            float(box[0]), float(box[1]),
-            float(box[2]), float(box[3]),
-        ]
-        bounding_box = Polygon.from_bbox((bbox_coords))
-        bounding_box = Envelope((bbox_coords))
-        sites = models.Site.objects.filter(
-            coordinates__intersects=bounding_box.wkt)
-        queryset = models.Image.objects.filter(Q(site_id__in=sites)
-                                               & Q(published=True)).order_by('type__order')
-        return queryset
+        params = self.request.GET
+        queryset = models.Image.objects.filter(published=True)
+        coords = search_cache.parse_bbox(params["in_bbox"].strip())
+        if coords:
+            queryset = queryset.filter(search_cache.bbox_q(coords))
+        return queryset.order_by('type__order')
 
     filterset_fields = [
         'id']+get_fields(models.Image, exclude=['created_at', 'updated_at'] + ['iiif_file', 'file'])
@@ -186,7 +277,10 @@ class SearchKeywords(DynamicDepthViewSet):
     def get_queryset(self):
         q = self.request.GET["keyword"]
         language = self.request.GET["language"]
-        if language == "sv":
+        if autocomplete.enabled():
+            queryset = models.KeywordTag.objects.filter(
+                id__in=autocomplete.engine.search("keywords", q, language)).order_by('text', 'category')
+        elif language == "sv":
             queryset = models.KeywordTag.objects.filter(
                 Q(text__icontains=q) | Q(category__icontains=q)).distinct().order_by('text', 'category')
         else:
@@ -199,6 +293,9 @@ class SearchRockCarving(DynamicDepthViewSet):
 
     def get_queryset(self):
         q = self.request.GET["carving_object"]
+        if autocomplete.enabled():
+            return models.RockCarvingObject.objects.filter(
+                id__in=autocomplete.engine.search("rock carving", q)).order_by('name')
         queryset = models.RockCarvingObject.objects.filter(
             name__icontains=q).order_by('name')
         return queryset
@@ -208,16 +305,14 @@ class SearchAuthor(DynamicDepthViewSet):
 
     def get_queryset(self):
         q = self.request.GET["auhtor_name"]
-        images = models.Image.objects.all()
+        has_images = Exists(models.Image.objects.filter(author=OuterRef('pk')))
         language = self.request.GET["language"]
         if language == "sv":
             queryset = models.Author.objects.filter(Q(name__icontains=q) &
-                                                    Q(id__in=list(images.values_list('author', flat=True))
-                                                      )).order_by('name')
+                                                    Q(has_images)).order_by('name')
         else:
             queryset = models.Author.objects.filter(Q(english_translation__icontains=q) &
-                                                    Q(id__in=list(images.values_list('author', flat=True))
-                                                      )).order_by('name')
+                                                    Q(has_images)).order_by('name')
         return queryset
 
 class SearchPeople(DynamicDepthViewSet):
@@ -226,7 +321,10 @@ class SearchPeople(DynamicDepthViewSet):
     def get_queryset(self):
         q = self.request.GET["auhtor_name"]
         language = self.request.GET["language"]
-        if language == "sv":
+        if autocomplete.enabled():
+            queryset = models.People.objects.filter(
+                id__in=autocomplete.engine.search("people", q, language)).order_by('name')
+        elif language == "sv":
             queryset = models.People.objects.filter(
                 name__icontains=q).order_by('name')
         else:
@@ -240,6 +338,9 @@ class SearchInstitution(DynamicDepthViewSet):
 
     def get_queryset(self):
         q = self.request.GET["institution_name"]
+        if autocomplete.enabled():
+            return models.Institution.objects.filter(
+                id__in=autocomplete.engine.search("institution", q)).order_by('name')
         queryset = models.Institution.objects.filter(
             name__icontains=q).order_by('name')
         return queryset
@@ -250,7 +351,10 @@ class SearchDatinTag(DynamicDepthViewSet):
     def get_queryset(self):
         q = self.request.GET["dating_tag"]
         language = self.request.GET["language"]
-        if language == "sv":
+        if autocomplete.enabled():
+            queryset = models.DatingTag.objects.filter(
+                id__in=autocomplete.engine.search("dating", q, language)).order_by('text')
+        elif language == "sv":
             queryset = models.DatingTag.objects.filter(
                 text__icontains=q).order_by('text')
         else:
@@ -264,7 +368,10 @@ class TypeSearchViewSet(DynamicDepthViewSet):
     def get_queryset(self):
         q = self.request.GET["image_type"]
         language = self.request.GET["language"]
-        if language == "sv":
+        if autocomplete.enabled():
+            queryset = models.ImageTypeTag.objects.filter(
+                id__in=autocomplete.engine.search("type", q, language)).order_by('text')
+        elif language == "sv":
             queryset = models.ImageTypeTag.objects.filter(
                 text__icontains=q).order_by('text')
         else:
@@ -273,15 +380,17 @@ class TypeSearchViewSet(DynamicDepthViewSet):
         return queryset
 
 
-class SearchVisualizationGroupViewset(DynamicDepthViewSet):
+class SearchVisualizationGroupViewset(CompactGeoJSONMixin, DynamicDepthViewSet):
     serializer_class = serializers.SiteCoordinatesExcludeSerializer
+    compact_lookups = {"parish": "parish__name", "municipality": "municipality__name", "province": "province__name"}
 
     def get_queryset(self):
         q = self.request.GET.get("site_name", "").strip()
 
+        # Sites with 3D models, counted in the precomputed site statistics
         queryset = models.Site.objects.filter(
-            Q(shfa3d__isnull=False)
-        ).distinct()
+            stats__visualization_group_count__gt=0
+        ).select_related('parish', 'municipality', 'province')
         
         # Apply search filter if query exists
         if q:
@@ -296,13 +405,8 @@ class SearchVisualizationGroupViewset(DynamicDepthViewSet):
         
         # Add annotations for counts
         queryset = queryset.annotate(
-            visualization_group_count=Count('shfa3d', distinct=True),
-            images_count=Count('image', filter=Q(image__group__isnull=False), distinct=True)
-        )
-        
-        # Filter to only sites that actually have 3D models or images
-        queryset = queryset.filter(
-            Q(visualization_group_count__gt=0) | Q(images_count__gt=0)
+            visualization_group_count=F('stats__visualization_group_count'),
+            images_count=F('stats__group_image_count')
         )
         
         return queryset.order_by('-visualization_group_count', '-images_count', 'raa_id')
@@ -316,85 +420,32 @@ class RegionSearchViewSet(DynamicDepthViewSet):
     def get_queryset(self):
         # Get search parameter
         region_query = self.request.GET.get('region_name', '').strip()
-        
-        # Get all unique region combinations from sites with images
-        sites = models.Site.objects.filter(
-            id__in=models.Image.objects.values_list('site', flat=True)
-        )
 
-        # Apply region search filter if provided - use the same relationships as SummaryViewSet
-        if region_query:
-            sites = sites.filter(
-                Q(parish__name__icontains=region_query) |
-                Q(municipality__name__icontains=region_query) |
-                Q(province__name__icontains=region_query) |
-                Q(province__country__name__icontains=region_query) |
-                Q(municipality__superregion__superregion__superregion__superregion__name__icontains=region_query)
-            )
+        # Precomputed regions of the sites with images, see regions.py
+        regions = models.RegionLabel.objects.all()
 
-        # Build unique region combinations - use the same fields as SummaryViewSet
-        regions = sites.values(
-            'parish__name',
-            'municipality__name', 
-            'province__name',
-            'province__country__name',
-            'municipality__superregion__superregion__superregion__superregion__name'
-        ).distinct()
-
-        # Filter out completely empty rows
-        regions = regions.exclude(
-            parish__name__isnull=True,
-            municipality__name__isnull=True,
-            province__name__isnull=True,
-            province__country__name__isnull=True,
-            municipality__superregion__superregion__superregion__superregion__name__isnull=True
-        )
+        # Trigram-indexed match against every name of the region
+        if region_query:
+            regions = regions.filter(search_text__icontains=region_query)
 
-        return regions
+        return regions.order_by('label')
 
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
 
-        # Format results as requested
-        results = []
-        seen_regions = set()  # To avoid duplicates
-        
-        for region in queryset:
-            parish = region.get('parish__name')
-            municipality = region.get('municipality__name') 
-            province = region.get('province__name')
-            # Use the same country logic as SummaryViewSet
-            country = (region.get('province__country__name') or 
-                      region.get('municipality__superregion__superregion__superregion__superregion__name'))
-            
-            # Build region string based on available fields
-            if parish and municipality and province and country:
-                region_str = f"{parish}, {municipality}, {province}, {country}"
-            elif municipality and province and country:
-                region_str = f"{municipality}, {province}, {country}"
-            elif province and country:
-                region_str = f"{province}, {country}"
-            elif municipality and country:
-                region_str = f"{municipality}, {country}"
-            elif country:
-                region_str = country
-            else:
-                continue  # Skip if no meaningful data
-            
-            # Avoid duplicates
-            if region_str not in seen_regions:
-                seen_regions.add(region_str)
-                results.append({
-                    "region": region_str,
-                    "parish": parish,
-                    "municipality": municipality,
-                    "province": province,
-                    "country": country
-                })
+        results = [
+            {
+                "region": label,
+                "parish": parish,
+                "municipality": municipality,
+                "province": province,
+                "country": country,
+                "image_count": image_count,
+            }
+            for label, parish, municipality, province, country, image_count in queryset.values_list(
+                'label', 'parish', 'municipality', 'province', 'country', 'image_count')
+        ]
 
-        # Sort results alphabetically
-        results.sort(key=lambda x: x['region'])
-        
         return Response({
             "count": len(results),
             "results": results
@@ -410,34 +461,16 @@ class GeneralSearch(DynamicDepthViewSet):
         if not q:
             return models.Image.objects.none()
 
+        # Query the denormalized search document instead of the join fan-out
+        query = search_index.search_query(q)
         queryset = models.Image.objects.select_related(
-            'site__parish', 'site__municipality', 'site__province', 'institution', 'type'
-        ).prefetch_related(
-            'dating_tags', 'people', 'keywords', 'rock_carving_object'
-        ).filter(
-            Q(dating_tags__text__icontains=q) |
-            Q(dating_tags__english_translation__icontains=q) |
-            Q(people__name__icontains=q) |
-            Q(people__english_translation__icontains=q) |
-            Q(type__text__icontains=q) |
-            Q(type__english_translation__icontains=q) |
-            Q(site__raa_id__icontains=q) |
-            Q(site__lamning_id__icontains=q) |
-            Q(site__askeladden_id__icontains=q) |
-            Q(site__lokalitet_id__icontains=q) |
-            Q(site__placename__icontains=q) |
-            Q(keywords__text__icontains=q) |
-            Q(keywords__english_translation__icontains=q) |
-            Q(keywords__category__icontains=q) |
-            Q(keywords__category_translation__icontains=q) |
-            Q(rock_carving_object__name__icontains=q) |
-            Q(institution__name__icontains=q) |
-            Q(site__parish__name__icontains=q) |
-            Q(site__municipality__name__icontains=q) |
-            Q(site__province__name__icontains=q)
+            'site', 'institution', 'type'
         ).filter(
+            search_index.document_q(q, query),
             published=True
-        ).distinct().order_by('-id', 'type__order')
+        ).annotate(
+            rank=SearchRank(F('search_document__search_vector'), query)
+        ).order_by('-rank', '-id')
 
         return queryset
 
@@ -451,26 +484,14 @@ class AdvancedSearch(DynamicDepthViewSet):
 
         query_conditions = []
 
-        # Define mapping between query params and model fields
-        field_mapping = {
-            "site_name": ["site__raa_id", "site__lamning_id", "site__askeladden_id",
-                          "site__lokalitet_id", "site__placename", "site__ksamsok_id"],
-            "keyword": ["keywords__text", "keywords__english_translation", "keywords__category", "keywords__category_translation"],
-            "author_name": ["people__name", "people__english_translation"],
-            "dating_tag": ["dating_tags__text", "dating_tags__english_translation"],
-            "image_type": ["type__text", "type__english_translation"],
-            "institution_name": ["institution__name"],
-            "region_name": ["site__parish__name", "site__municipality__name", "site__province__name"],
-        }
+        # Each parameter is matched against its column of the search document
+        params = ["site_name", "keyword", "author_name", "dating_tag",
+                  "image_type", "institution_name", "region_name"]
 
-        for param, fields in field_mapping.items():
+        for param in params:
             if param in query_params:
-                value = query_params[param]
-                # Creating OR conditions for each field
-                or_conditions = [Q(**{field + '__icontains': value})
-                                 for field in fields]
                 query_conditions.append(
-                    reduce(lambda x, y: x | y, or_conditions))
+                    search_index.field_q(param, query_params[param]))
 
         if not query_conditions:
             # Handle no query parameters provided
@@ -564,14 +585,57 @@ class BaseSearchViewSet(DynamicDepthViewSet):
                         "site__askeladden_id", "site__lokalitet_id", "site__ksamsok_id"],
             "rock_carving_object": ["rock_carving_object__name"],
             "year": ["year"],
-            "q": []  # Placeholder for general search across all fields
+            "q": []  # General search, matched against the image search document
         }
     
+    def get_search_id_fields_mapping(self):
+        """Define the ID parameters, the search parameter they belong to
+        and the image field they are matched against."""
+        return {
+            "keyword_id": ("keyword", "keywords"),
+            "author_id": ("author_name", "people"),
+            "dating_tag_id": ("dating_tag", "dating_tags"),
+            "image_type_id": ("image_type", "type"),
+            "institution_id": ("institution_name", "institution"),
+            "site_id": ("site_name", "site"),
+            "rock_carving_object_id": ("rock_carving_object", "rock_carving_object"),
+        }
+
+    def parse_id_values(self, values):
+        """Parse integer IDs from query parameters, ignoring anything else."""
+        ids = []
+        for value in self.parse_multi_values(values):
+            try:
+                ids.append(int(value))
+            except ValueError:
+                continue
+        return ids
+
+    def resolve_exact_ids(self, param_key, image_field, values):
+        """Map the values naming a tag exactly (case-insensitively) to the
+        IDs of the tags, so that they are matched by equality."""
+        _, ALL_FIELDS = self.get_type_field_keys()
+
+        tag_fields = [field.split("__", 1)[1] for field in ALL_FIELDS[param_key]]
+        tag_model = models.Image._meta.get_field(image_field).related_model
+        condition = reduce(lambda x, y: x | y, [
+            Q(**{f"{field}__iexact": value}) for field in tag_fields for value in values
+        ])
+
+        wanted = {value.lower() for value in values}
+        matches = {}
+        for row in tag_model.objects.filter(condition).values_list('id', *tag_fields):
+            for text in row[1:]:
+                text = str(text).lower() if text is not None else None
+                if text in wanted:
+                    matches.setdefault(text, set()).add(row[0])
+
+        return {value: sorted(matches[value.lower()]) for value in values if value.lower() in matches}
+
     def get_type_field_keys(self):
         """Define search type configurations."""
         ALL_FIELDS = self.get_search_fields_mapping()
-        ALL_FIELDS["q"] = sorted(set(chain.from_iterable(ALL_FIELDS.values())))
-        
+
         return {
             "advanced": ["site_name", "author_name", "dating_tag",
                         "image_type", "institution_name", "region_name",
@@ -579,6 +643,44 @@ class BaseSearchViewSet(DynamicDepthViewSet):
             "general": ["q"],
         }, ALL_FIELDS
     
+    def get_field_operator(self, params, param_key, operator="OR"):
+        """Operator combining the values of a parameter; only authors,
+        keywords and dating tags can be combined with AND."""
+        op_param = {
+            "author_name": "author_operator",
+            "keyword": "keyword_operator",
+            "dating_tag": "dating_operator"
+        }.get(param_key)
+        if not op_param:
+            return "OR"
+        field_operator = params.get(op_param, operator).upper()
+        return field_operator if field_operator in ["AND", "OR"] else "OR"
+
+    def split_indexed_params(self, params, search_type, operator="OR"):
+        """Split the tag filters answered by the bitmap index from the
+        other parameters.
+
+        Returns {param: (values, operator)} for the index and the
+        remaining parameters.
+        """
+        if not tag_index.enabled():
+            return {}, params
+
+        TYPE_FIELD_KEYS, ALL_FIELDS = self.get_type_field_keys()
+        field_keys = TYPE_FIELD_KEYS.get(search_type, list(ALL_FIELDS.keys()))
+
+        indexed = {}
+        for param_key in tag_index.DIMENSIONS:
+            values = self.parse_multi_values(params.getlist(param_key)) if param_key in field_keys else []
+            if values:
+                indexed[param_key] = (values, self.get_field_operator(params, param_key, operator))
+
+        if indexed:
+            params = params.copy()
+            for param_key in indexed:
+                params.pop(param_key)
+        return indexed, params
+
     def build_search_query(self, params, search_type="advanced", operator="OR"):
         """
         Build search structure that supports AND operators with separate joins.
@@ -593,11 +695,7 @@ class BaseSearchViewSet(DynamicDepthViewSet):
         mapping_filter_fields = {key: ALL_FIELDS[key] for key in field_keys}
 
         operator_controlled_fields = ["author_name", "keyword", "dating_tag"]
-        field_operator_mapping = {
-            "author_name": "author_operator",
-            "keyword": "keyword_operator",
-            "dating_tag": "dating_operator"
-        }
+        id_fields = {param: field for param, field in self.get_search_id_fields_mapping().values()}
 
         chain_filters = []   # For AND operations (separate joins)
         grouped_qs = []      # For OR operations (combined)
@@ -645,17 +743,20 @@ class BaseSearchViewSet(DynamicDepthViewSet):
             if not values:
                 continue
 
-            if param_key in operator_controlled_fields:
-                op_param = field_operator_mapping.get(param_key)
-                field_operator = params.get(op_param, operator).upper()
-                if field_operator not in ["AND", "OR"]:
-                    field_operator = "OR"
-            else:
-                field_operator = "OR"
+            field_operator = self.get_field_operator(params, param_key, operator)
+
+            # Values naming a tag exactly are matched by ID, the rest by text
+            exact_ids = self.resolve_exact_ids(param_key, id_fields[param_key], values) if param_key in id_fields else {}
 
             # Build OR cluster per value
             per_value_clusters = []
             for val in values:
+                if param_key == "q":
+                    per_value_clusters.append(search_index.document_q(val))
+                    continue
+                if val in exact_ids:
+                    per_value_clusters.append(Q(**{f"{id_fields[param_key]}__in": exact_ids[val]}))
+                    continue
                 cluster = Q()
                 for f in fields:
                     cluster |= Q(**{f"{f}__icontains": val})
@@ -670,6 +771,18 @@ class BaseSearchViewSet(DynamicDepthViewSet):
                     or_group = reduce(lambda x, y: x | y, per_value_clusters)
                     grouped_qs.append(or_group)
 
+        # ID filters (e.g. keyword_id=12) are equality checks on the foreign key or m2m
+        for id_key, (param_key, image_field) in self.get_search_id_fields_mapping().items():
+            if param_key not in field_keys:
+                continue
+            ids = self.parse_id_values(params.getlist(id_key))
+            if not ids:
+                continue
+            if self.get_field_operator(params, param_key, operator) == "AND":
+                chain_filters.extend(Q(**{image_field: pk}) for pk in ids)
+            else:
+                grouped_qs.append(Q(**{f"{image_field}__in": ids}))
+
         # Combine OR groups
         single_q = None
         if grouped_qs:
@@ -690,21 +803,73 @@ class BaseSearchViewSet(DynamicDepthViewSet):
             "single_q": single_q
         }
 
-    def apply_bbox_filter(self, queryset, bbox_param):
-        """Apply bounding box filter to queryset."""
+    def apply_bbox_filter(self, queryset, bbox_param, precision=None):
+        """Apply bounding box filter to queryset, with the box rounded
+        outwards to precision decimals if given."""
         if not bbox_param:
             return queryset
-            
-        coords = list(map(float, bbox_param.split(",")))
-        if len(coords) == 4:
-            polygon = Polygon.from_bbox(coords)
-            site_ids = models.Site.objects.filter(
-                coordinates__intersects=polygon
-            ).values_list("id", flat=True)
-            return queryset.filter(site_id__in=site_ids)
+
+        if precision is None:
+            coords = search_cache.parse_bbox(bbox_param)
+        else:
+            coords = search_cache.round_bbox(bbox_param, precision)
+        if coords:
+            return queryset.filter(search_cache.bbox_q(coords))
 
         return queryset
     
+    def search_image_ids(self, params, search_type, operator):
+        """Sorted IDs of the published images matching a search, or None
+        if the search filters nothing.
+
+        The ID list is cached per canonical search and shared by the
+        category, gallery and summary endpoints, which the frontend calls
+        with the same parameters. Changes to images, tags or sites
+        invalidate it (see search_cache.bump_generation). The bounding box
+        is rounded outwards to the precision of the cache key, so that
+        nearby boxes share the IDs; filter_search narrows them to the box.
+        """
+        key = search_cache.search_cache_key(
+            "image-ids", params, exclude={"category_type", "search_type"}, search_type=search_type)
+
+        # The query is only built on a miss, as resolving it reads the database
+        ids = search_cache.get_ids(key)
+        if ids is not None:
+            return ids
+
+        # Tag filters are answered from the bitmap index when it is enabled
+        indexed, params = self.split_indexed_params(params, search_type, operator)
+        search_struct = self.build_search_query(params, search_type, operator)
+        bbox_param = params.get("in_bbox")
+        filtered = search_struct["chain_filters"] or search_struct["single_q"] or bbox_param
+        if not indexed and not filtered:
+            return None
+
+        bitmap = tag_index.index.select(indexed) if indexed else None
+        if filtered:
+            queryset = models.Image.objects.filter(published=True)
+            for q_part in search_struct["chain_filters"]:
+                queryset = queryset.filter(q_part)
+            if search_struct["single_q"]:
+                queryset = queryset.filter(search_struct["single_q"])
+            queryset = self.apply_bbox_filter(queryset, bbox_param, precision=search_cache.bbox_precision(params))
+
+            ids = list(queryset.order_by('id').values_list('id', flat=True).distinct())
+            if bitmap is not None:
+                ids = [pk for pk in ids if pk in bitmap]
+        else:
+            ids = sorted(bitmap)
+        search_cache.set_ids(key, ids)
+        return ids
+
+    def filter_search(self, queryset, params, search_type, operator):
+        """Restrict an image queryset to the results of a search."""
+        ids = self.search_image_ids(params, search_type, operator)
+        if ids is None:
+            return queryset
+        queryset = queryset.filter(search_cache.ids_q(ids))
+        return self.apply_bbox_filter(queryset, params.get("in_bbox"))
+
     def get_base_image_queryset(self):
         """Get optimized base queryset for images."""
         return (
@@ -730,23 +895,9 @@ class SearchCategoryViewSet(BaseSearchViewSet):
 
         queryset = self.get_base_image_queryset()
 
-        # Apply search filters using the corrected build_search_query method
-        if any(params.get(field) for field in ["site_name", "author_name", "dating_tag", 
-                                              "image_type", "institution_name", "region_name", 
-                                              "visualization_group", "keyword", "rock_carving_object", "3d_site", "q"]):
-            search_struct = self.build_search_query(params, search_type, operator)
-            
-            # Apply chain filters first (each creates separate join)
-            for q_part in search_struct["chain_filters"]:
-                queryset = queryset.filter(q_part)
-            
-            # Apply combined OR query
-            if search_struct["single_q"]:
-                queryset = queryset.filter(search_struct["single_q"])
-
-        # Apply bbox filter
-        queryset = self.apply_bbox_filter(queryset, params.get("in_bbox"))
-        return queryset.distinct().order_by('type__order', 'id')
+        # Apply search and bbox filters through the shared result cache
+        queryset = self.filter_search(queryset, params, search_type, operator)
+        return queryset.order_by('type__order', 'id')
 
 
     def categorize_by_type(self, queryset):
@@ -796,40 +947,181 @@ class SearchCategoryViewSet(BaseSearchViewSet):
         }
         return Response(response_data, status=status.HTTP_200_OK)
 
+class CountingPaginator(DjangoPaginator):
+    """Django paginator that takes its count from a callable."""
+
+    def __init__(self, object_list, per_page, count_function=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_function = count_function
+
+    @cached_property
+    def count(self):
+        if self.count_function is None:
+            return super().count
+        return self.count_function(self.object_list)
+
+
 # Custom pagination class to return bounding box for paginated results
 class BoundingBoxPagination(PageNumberPagination):
     page_size = 25
     page_size_query_param = 'limit'
     max_page_size = 100
 
-    # This is the key optimization: override the count to be fast
-    @cached_property
-    def count(self):
-        """
-        Uses PostgreSQL's fast row estimation instead of a slow COUNT(*).
+    # Searches the planner expects to match fewer rows than this are
+    # counted exactly, larger ones use the planner estimate
+    exact_count_threshold = getattr(settings, 'SHFA_EXACT_COUNT_THRESHOLD', 20000)
+    count_cache_timeout = getattr(settings, 'SHFA_COUNT_CACHE_TIMEOUT', 60 * 10)
+
+    def django_paginator_class(self, object_list, per_page):
+        return CountingPaginator(object_list, per_page, count_function=self.get_count)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_method = None
+        self.count_cache_key = search_cache.search_cache_key("gallery-count", request.GET)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count(self, queryset):
+        """Count the filtered queryset, exactly when cheap and estimated otherwise.
+
+        The result is cached per normalized search, so paging through a
+        search only counts it once.
         """
+        cached = cache.get(self.count_cache_key)
+        if cached is not None:
+            count, self.count_method = cached
+            return count
+
+        estimate = self.estimate_count(queryset)
+        if estimate is None or estimate < self.exact_count_threshold:
+            count, self.count_method = queryset.count(), "exact"
+        else:
+            count, self.count_method = estimate, "estimate"
+
+        cache.set(self.count_cache_key, (count, self.count_method), self.count_cache_timeout)
+        return count
+
+    def estimate_count(self, queryset):
+        """Row estimate of the PostgreSQL planner for the queryset, or None."""
         try:
-            # This is getting the TOTAL table size, not your filtered queryset!
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT reltuples::BIGINT FROM pg_class WHERE relname = %s", 
-                            [self.object_list.model._meta.db_table])
-                estimate = cursor.fetchone()[0]
-                
-                # This returns the entire table size, not your search results
-                self._count_cache = min(estimate + 1000, 1000000)  # Max 1M
-                return self._count_cache
-        except Exception:
-            return 10000  # This fallback is probably what you're seeing
-
-        def get_paginated_response(self, data):
-            return Response({
-                'count': self.count,
-                'next': self.get_next_link(),
-                'previous': self.get_previous_link(),
-                'estimated_count': True, # Inform the client this is an estimate
-                'results': data
-            })
-    
+            sql, params = queryset.query.sql_with_params()
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]["Plan"]["Plan Rows"])
+        except Exception as e:
+            import logging
+            logging.warning(f"Could not estimate count: {e}")
+            return None
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'count_method': self.count_method,
+            'estimated_count': self.count_method == "estimate",
+            'results': data
+        })
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over image IDs, for infinite scrolling.
+
+    Pages continue from the last row of the previous page through an
+    opaque ``cursor`` token, so deep pages never scan the skipped rows.
+    Pass an empty ``?cursor=`` for the first page. ``cursor_ordering=type``
+    orders by image type order before ID.
+    """
+    page_size = 25
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'cursor_ordering'
+
+    # Supported orderings, each ending in the unique image ID
+    orderings = {
+        "id": ("id",),
+        "type": ("type_order", "id"),
+    }
+
+    # Sort images without a type last
+    NULL_TYPE_ORDER = 2 ** 31 - 1
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.next_cursor = None
+        page_size = self.get_page_size(request)
+
+        ordering_name = request.query_params.get(self.ordering_query_param, "id")
+        if ordering_name not in self.orderings:
+            ordering_name = "id"
+        ordering = self.orderings[ordering_name]
+
+        # Deduplicate through a semi-join instead of DISTINCT on the page query
+        images = queryset.model.objects.filter(id__in=queryset.order_by().values('id'))
+        if ordering_name == "type":
+            images = images.annotate(
+                type_order=Coalesce('type__order', Value(self.NULL_TYPE_ORDER)))
+
+        position = self.decode_cursor(request.query_params.get(self.cursor_query_param), ordering_name)
+        if position:
+            images = images.filter(self.after_position(ordering, position))
+
+        rows = list(images.order_by(*ordering).values(*ordering)[:page_size + 1])
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            self.next_cursor = self.encode_cursor(ordering_name, [rows[-1][field] for field in ordering])
+
+        return [{'id': row['id']} for row in rows]
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def after_position(self, ordering, position):
+        """Q object selecting the rows after a keyset position."""
+        condition = Q()
+        equal = {}
+        for field, value in zip(ordering, position):
+            condition |= Q(**equal, **{f"{field}__gt": value})
+            equal[field] = value
+        return condition
+
+    def encode_cursor(self, ordering_name, position):
+        payload = json.dumps({"o": ordering_name, "p": position}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, token, ordering_name):
+        if not token:
+            return None
+        try:
+            padded = token + "=" * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            position = [int(value) for value in payload["p"]]
+        except (TypeError, ValueError, KeyError):
+            raise NotFound("Invalid cursor")
+        if payload.get("o") != ordering_name or len(position) != len(self.orderings[ordering_name]):
+            raise NotFound("Invalid cursor")
+        return position
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': None,
+            'results': data
+        })
+
+
 class GalleryViewSet(BaseSearchViewSet):
     """Search images by category with pagination and full search capabilities."""
     serializer_class = serializers.GallerySerializer
@@ -838,6 +1130,16 @@ class GalleryViewSet(BaseSearchViewSet):
     filterset_fields = ['id'] + get_fields(models.Image, exclude=['iiif_file', 'file'])
     bbox_filter_field = 'coordinates'
 
+    @property
+    def paginator(self):
+        """Keyset pagination when a cursor is given, page numbers otherwise."""
+        if not hasattr(self, '_paginator'):
+            if KeysetPagination.cursor_query_param in self.request.query_params:
+                self._paginator = KeysetPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
     def get_queryset(self):
         params = self.request.GET
         operator = params.get("operator", "OR")
@@ -851,27 +1153,11 @@ class GalleryViewSet(BaseSearchViewSet):
         if category_type and category_type.lower() != "all":
             queryset = queryset.filter(type__text__iexact=category_type)
 
-        # Apply search filters
-        if any(params.get(field) for field in ["site_name", "author_name", "dating_tag", 
-                                              "image_type", "institution_name", "region_name", 
-                                              "visualization_group", "keyword", "rock_carving_object", "3d_site", "q"]):
-            search_struct = self.build_search_query(params, search_type, operator)
-            
-            # Apply chain filters first (each creates separate join)
-            for q_part in search_struct["chain_filters"]:
-                queryset = queryset.filter(q_part)
-            
-            # Apply combined OR query
-            if search_struct["single_q"]:
-                queryset = queryset.filter(search_struct["single_q"])
-
-        # Apply bounding box filter
-        bbox_param = params.get("in_bbox")
-        if bbox_param:
-            queryset = self.apply_bbox_filter(queryset, bbox_param)
+        # Apply search and bbox filters through the shared result cache
+        queryset = self.filter_search(queryset, params, search_type, operator)
 
         # Return only IDs, ordered for consistent pagination
-        return queryset.distinct('id').order_by('id').values('id')
+        return queryset.order_by('id').values('id')
 
     def list(self, request, *args, **kwargs):
         """Optimized list method with better error handling and memory management."""
@@ -902,6 +1188,9 @@ class GalleryViewSet(BaseSearchViewSet):
             
             return response
 
+        except APIException:
+            # Let DRF render client errors such as an invalid cursor
+            raise
         except Exception as e:
             # Log the error in production
             import logging
@@ -1003,107 +1292,17 @@ class GeneralSearchAutocomplete(ViewSet):
         if not q:
             return Response([])
 
-        limit = 5
-        suggestions = []
-
-        def add_suggestions(filtered_qs, label):
-            seen = set()
-            for row in filtered_qs:
-                for val in row if isinstance(row, (tuple, list)) else [row]:
-                    if val:
-                        val_str = str(val).strip()
-                        if q in val_str.lower() and val_str.lower() not in seen:
-                            suggestions.append({"value": val_str, "source": label})
-                            seen.add(val_str.lower())
-
-        # Keywords
-        keywords_filtered = models.Image.objects.filter(
-            Q(keywords__text__icontains=q) |
-            Q(keywords__english_translation__icontains=q) |
-            Q(keywords__category__icontains=q) |
-            Q(keywords__category_translation__icontains=q)
-        ).values_list(
-            "keywords__text", "keywords__english_translation",
-            "keywords__category", "keywords__category_translation"
-        ).distinct()[:limit]
-
-        add_suggestions(keywords_filtered, "keywords")
-
-        # People
-        people_filtered = models.Image.objects.filter(
-            Q(people__name__icontains=q) |
-            Q(people__english_translation__icontains=q)
-        ).values_list("people__name", "people__english_translation").distinct()[:limit]
-
-        add_suggestions(people_filtered, "people")
-
-        # Site
-        site_filtered = models.Image.objects.filter(
-            Q(site__placename__icontains=q) |
-            Q(site__raa_id__icontains=q) 
-            # Q(site__lamning_id__icontains=q) |
-            # Q(site__askeladden_id__icontains=q) |
-            # Q(site__lokalitet_id__icontains=q) |
-            # Q(site__ksamsok_id__icontains=q)
-        # ).values_list(
-        #     "site__placename", "site__raa_id", "site__lamning_id",
-        #     "site__askeladden_id", "site__lokalitet_id", "site__ksamsok_id"
-        # ).distinct()[:limit]
-        ).values_list(
-            "site__placename", "site__raa_id"
-        ).distinct()[:limit]
-
-        add_suggestions(site_filtered, "site")
-
-        # Type
-        type_filtered = models.Image.objects.filter(
-            Q(type__text__icontains=q) |
-            Q(type__english_translation__icontains=q)
-        ).values_list("type__text", "type__english_translation").distinct()[:limit]
-
-        add_suggestions(type_filtered, "type")
-
-        # Institution
-        institution_filtered = models.Image.objects.filter(
-            institution__name__icontains=q
-        ).values_list("institution__name", flat=True).distinct()[:limit]
-
-        add_suggestions(institution_filtered, "institution")
-
-        # Dating Tags
-        tags_filtered = models.Image.objects.filter(
-            Q(dating_tags__text__icontains=q) |
-            Q(dating_tags__english_translation__icontains=q)
-        ).values_list("dating_tags__text", "dating_tags__english_translation").distinct()[:limit]
-
-        add_suggestions(tags_filtered, "dating tag")
-
-        # Rock Carving
-        rc_filtered = models.Image.objects.filter(
-            rock_carving_object__name__icontains=q
-        ).values_list("rock_carving_object__name", flat=True).distinct()[:limit]
-
-        add_suggestions(rc_filtered, "rock carving")
-
-        # Region
-        region_filtered = models.Image.objects.filter(
-            Q(site__parish__name__icontains=q) |
-            Q(site__municipality__name__icontains=q) |
-            Q(site__province__name__icontains=q)
-        ).values_list(
-            "site__parish__name", "site__municipality__name", "site__province__name"
-        ).distinct()[:limit]
-
-        add_suggestions(region_filtered, "region")
-
-        # duplicate and sort
-        unique_suggestions = {(s["value"], s["source"]) for s in suggestions}
-        sorted_suggestions = sorted(
-            [{"value": v, "source": s} for v, s in unique_suggestions],
-            key=lambda x: x["value"]
-        )[:20]
-
-        return Response(sorted_suggestions)
+        # In-process index if enabled, otherwise one indexed query
+        # against the suggestion table, see suggestions.py
+        if autocomplete.enabled():
+            results = autocomplete.engine.suggest(q, suggestions.LIMIT)
+        else:
+            results = suggestions.suggest(q)
+
+        return Response([
+            {"value": suggestion["term"], "source": suggestion["source"]}
+            for suggestion in results
+        ])
 
 class SummaryViewSet(BaseSearchViewSet):
     """A separate viewset to return summary data for images."""
@@ -1123,15 +1322,9 @@ class SummaryViewSet(BaseSearchViewSet):
         if category_type:
             queryset = queryset.filter(type__text__iexact=category_type)
 
-        # Apply search filters using new structure
-        search_struct = self.build_search_query(params, search_type, operator)
-        for q_part in search_struct["chain_filters"]:
-            queryset = queryset.filter(q_part)
-        if search_struct["single_q"]:
-            queryset = queryset.filter(search_struct["single_q"])
-
-        queryset = self.apply_bbox_filter(queryset, params.get("in_bbox"))
-        return queryset.distinct().order_by('type__order', 'id')
+        # Apply search and bbox filters through the shared result cache
+        queryset = self.filter_search(queryset, params, search_type, operator)
+        return queryset.order_by('type__order', 'id')
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
@@ -1141,179 +1334,13 @@ class SummaryViewSet(BaseSearchViewSet):
         return Response(summary_data)
 
     def summarize_results(self, queryset):
-        """Summarizes search results by creator and institution."""
-        # we should add Summarise search results by geographic data too: TODO
-        # Summarise by ADM0, ADM1, ADM2, socken, kommun, landskap/län: TODO
-        # motif: Two level summary with keyword categories and subcategories: Done
-        # Count of documentation types by site: Done
-        # Show number of images for each year: Done
-        # Summarise search results by creator and institution : Done
-
-        summary = {
-            "creators": [],
-            "institutions": [],
-            "year": [],
-            "types": [],
-            "motifs": [],
-            "geographic": [],
-            "site": []
-        }
-
-        # Count images per creator
-        creator_counts = (
-            queryset
-            .values("people__name")
-            .annotate(count=Count("id", distinct=True))
-            .order_by("-count")
-        )
+        """Summarizes search results by creator, institution, year, type,
+        motif, site and geography.
 
-        # Count images per institution
-        institution_counts = (
-            queryset
-            .values("institution__name")
-            .annotate(count=Count("id", distinct=True))
-            .order_by("-count")
-        )
-        # Count of documentation types by site
-        type_counts = (
-            queryset
-            .values("type__text", "type__english_translation")
-            .annotate(count=Count("id", distinct=True))
-            .order_by("-count")
-        )
-        # Summarise search results by motif type
-        motif_counts = (
-            queryset
-            .values("keywords__text", "keywords__english_translation" ,"keywords__category_translation", "keywords__figurative")
-            .annotate(count=Count("id", distinct=True))
-            .order_by("-count")
-        )
-        # Show number of images for each year 
-        year_counts = (
-            queryset
-            .values("year")
-            .annotate(count=Count("id", distinct=True))
-            .order_by("year")
-        )
-
-        site_counts = (
-            queryset
-            .values("site__raa_id", "site__lamning_id", "site__askeladden_id",
-                    "site__lokalitet_id", "site__placename", "site__ksamsok_id")
-            .annotate(count=Count("id", distinct=True))
-            .order_by("-count")
-        )
-
-        # Gorgraphic summary can be a json object with counts for each level of geographic data
-        # ADM0, ADM1, ADM2, socken, kommun, landskap/län
-    
-        geographic_counts = (
-            queryset
-            .values("site__municipality__name", "site__parish__name", "site__province__name", 
-                    "site__province__country__name", "site__municipality__superregion__superregion__superregion__superregion__name")
-            .annotate(count=Count("id", distinct=True))
-            .order_by("-count")
-        )
-
-        # Format summary
-        summary["creators"] = [
-            {"creator": entry["people__name"], "count": entry["count"]}
-            for entry in creator_counts if entry["people__name"]
-        ]
-
-        summary["site"] = [
-            {
-                "raa_id": entry.get("site__raa_id"),
-                "lamning_id": entry.get("site__lamning_id"),
-                "askeladden_id": entry.get("site__askeladden_id"),
-                "lokalitet_id": entry.get("site__lokalitet_id"),
-                "placename": entry.get("site__placename"),
-                "ksamsok_id": entry.get("site__ksamsok_id"),
-                "count": entry["count"]
-            }
-            for entry in site_counts
-            if any([
-                entry.get("site__raa_id"),
-                entry.get("site__lamning_id"),
-                entry.get("site__askeladden_id"),
-                entry.get("site__lokalitet_id"),
-                entry.get("site__placename"),
-                entry.get("site__ksamsok_id")
-            ])
-        ]
-
-        summary["institutions"] = [
-            {"institution": entry["institution__name"], "count": entry["count"]}
-            for entry in institution_counts if entry["institution__name"]
-        ]   
-
-        summary["types"] = [
-            {
-                "type": entry["type__text"],
-                "translation": entry.get("type__english_translation"),
-                "count": entry["count"]
-            }
-            for entry in type_counts if entry["type__text"]
-        ]
-
-        # In the summarize_results method, replace the motifs section with:
-        summary["motifs"] = [
-            {
-                "motif": entry["keywords__text"],
-                "translation": entry.get("keywords__english_translation"),
-                "count": entry["count"],
-                "figurative": entry.get("keywords__figurative", False)
-            }
-            for entry in motif_counts
-            if "figure" in (entry.get("keywords__category_translation") or "").lower() and entry["keywords__text"]
-        ]
-
-        summary["year"] = [
-            {"year": entry["year"], "count": entry["count"]}
-            for entry in year_counts if entry["year"]
-        ]
-
-        # Geographic summary 
-        summary["province"] = [
-            {
-                "province": entry["site__province__name"],
-                "country": entry["site__province__country__name"],
-                "count": entry["count"]
-            }
-            for entry in geographic_counts if entry["site__province__name"]
-        ]
-
-        summary["municipality"] = [
-            {
-                "municipality": entry["site__municipality__name"],
-                "country": entry["site__province__country__name"] or entry["site__municipality__superregion__superregion__superregion__superregion__name"],
-                "count": entry["count"]
-            } 
-            for entry in geographic_counts if entry["site__municipality__name"]
-        ]
-
-        summary["parish"] = [
-            {
-                "parish": entry["site__parish__name"],
-                "province": entry["site__province__name"],
-                "country": entry["site__province__country__name"],
-                "count": entry["count"]
-            }
-            for entry in geographic_counts if entry["site__parish__name"]
-        ]
-        
-        summary["geographic"] = [
-            {
-                "municipality": entry["site__municipality__name"], 
-                "parish": entry["site__parish__name"], 
-                "province": entry["site__province__name"], 
-                "country": entry["site__province__country__name"] or entry["site__municipality__superregion__superregion__superregion__superregion__name"],
-                "count": entry["count"]
-            }
-            for entry in geographic_counts
-        ]
-
-        return summary
+        All facets are counted in one pass over the precomputed per-image
+        facet rows (see facets.summarize), instead of one GROUP BY per facet.
+        """
+        return facets.summarize(queryset)
     
 # VIEW FOR OAI_CAT
 @csrf_exempt